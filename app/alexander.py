@@ -1,11 +1,14 @@
 
 import numpy as np
 
-from .private.utilities import pre_alexander_compile, rot_saw_xy
-from .projection import find_reg_project
+from .metrics import instrument
+from .private.utilities import (build_crossing_table, gauss_code,
+                                pre_alexander_compile, reduce_polygon,
+                                reidemeister_simplify, rot_saw_xy)
+from .projection import find_reg_project, project_chains
 
 
-def populate_alexander_matrix(saw, t):
+def populate_alexander_matrix(saw, t, method="brute"):
    """return alexander matrix of the given saw.
    
    We are using the logic from the guiding paper for this project (soon to 
@@ -17,43 +20,91 @@ def populate_alexander_matrix(saw, t):
    to calculate
    proj - numpy array with shape (N, 2) - the regular projection of saw
    t - float - the polynomial parameter
+   method - str - the crossing finder, as in collect_all_intersections
    
    return value:
    alex_mat - numpy array with shape (I, I) where I is the number of underpasses.
    """
+   underpass_info = underpass_info_of_chain(saw, method)
+   A0, A1 = alexander_matrix_pencil(underpass_info)
+   alex_mat = A0 + t * A1
+
+   return alex_mat
+
+
+def underpass_info_of_chain(saw, method="brute"):
+   """return the output of pre_alexander_compile for saw, see populate_alexander_matrix."""
    rot_saw = rot_saw_xy(saw)
    proj = find_reg_project(saw)
-   underpass_info = pre_alexander_compile(rot_saw, proj)
+   return pre_alexander_compile(rot_saw, proj, method)
+
+
+def underpass_infos_of_chains(chains, method="brute"):
+   """return list of the outputs of pre_alexander_compile for a batch of chains.
+
+   Batch version of underpass_info_of_chain, for batched monte carlo runs and
+   for re-analysing a chain store (see iter_chains): the whole batch is
+   rotated and projected at once by project_chains, and only the crossing
+   tables are built chain by chain.
+
+   arguments:
+   chains - numpy array with shape (B, N+1, 3) - the chains, closed by their
+   first node repeated at the end as generate_closed_chain returns them
+   method - str - the crossing finder, as in collect_all_intersections
+   """
+   rotated_chains, projections = project_chains(chains)
+   return [pre_alexander_compile(rot_saw, proj, method)
+           for rot_saw, proj in zip(rotated_chains, projections)]
+
+
+def alexander_matrix_pencil(underpass_info):
+   """return integer matrices A0 and A1 such that the alexander matrix is A0 + t*A1.
+
+   Every entry of the alexander matrix is one of 1, -1, t - 1 and -t, so it
+   splits into a constant part and a part linear in t. This is where the
+   entries of populate_alexander_matrix are actually laid out.
+
+   arguments:
+   underpass_info - numpy array with shape (I, 2) - the output of
+   pre_alexander_compile
+
+   return value:
+   A0, A1 - numpy arrays of ints with shape (I, I)
+   """
    I = np.shape(underpass_info)[0]
-   alex_mat = np.zeros((I, I))
+   A0 = np.zeros((I, I), dtype=np.int64)
+   A1 = np.zeros((I, I), dtype=np.int64)
    
    for k in np.arange(I):
       if underpass_info[k, 1] == k or underpass_info[k, 1] == k+1:
-         alex_mat[k, k] = -1
+         A0[k, k] = -1
          if k == I-1:
             continue
-         else: alex_mat[k, k+1] = 1
+         else: A0[k, k+1] = 1
       else:
-         alex_mat[k, underpass_info[k, 1]] = t - 1
+         A0[k, underpass_info[k, 1]] = -1 # t - 1
+         A1[k, underpass_info[k, 1]] = 1
          if underpass_info[k, 0] == 0: # Type I
-            alex_mat[k, k] = 1
+            A0[k, k] = 1
             if k == I-1:
                continue
-            else: alex_mat[k, k+1] = -t
+            else: A1[k, k+1] = -1 # -t
          else: # Type II
-            alex_mat[k, k] = -t
+            A1[k, k] = -1 # -t
             if k == I-1:
                continue
-            else: alex_mat[k, k+1] = 1
+            else: A0[k, k+1] = 1
 
-   return alex_mat
+   return A0, A1
 
 
 from numpy.linalg import det
 
+from .private.modular_linalg import crt_integer_poly
 from .projection import find_reg_project
 
 
+@instrument("evaluate_alexander_polynomial")
 def evaluate_alexander_polynomial(alex_mat):
    if np.shape(alex_mat)[0] == 0:
       return 1
@@ -64,3 +115,212 @@ def evaluate_alexander_polynomial(alex_mat):
    # TODO: figure out power of t we need...or better work around
    final_result = int(np.round(abs(minor_det)))
    return final_result
+
+
+def alexander_polynomial(underpass_info):
+   """return the exact alexander polynomial, as a tuple of integer coefficients.
+
+   Unlike evaluate_alexander_polynomial, which only gives |Delta(-1)| (the
+   knot determinant) from a float determinant, this computes the whole of
+   Delta(t) = det of the first minor of the alexander matrix exactly. The
+   minor is the pencil A0 + t*A1, whose determinant is found modulo several
+   primes by a single elimination each and lifted to the integers (see
+   private.modular_linalg), so there is no float blow-up however many
+   crossings there are.
+
+   Delta(t) is only defined up to multiplication by +-t^k, so it is
+   normalized: powers of t are divided out and the sign makes Delta(1)
+   positive (or the constant coefficient, should Delta(1) vanish).
+
+   arguments:
+   underpass_info - numpy array with shape (I, 2) - the output of
+   pre_alexander_compile, see underpass_info_of_chain
+
+   return value:
+   tuple of ints - the coefficients of Delta(t), lowest degree first, (1,)
+   for the unknot
+   """
+   if np.shape(underpass_info)[0] == 0:
+      return (1,)
+   A0, A1 = alexander_matrix_pencil(underpass_info)
+   coefficients = crt_integer_poly(A0[1:, 1:], A1[1:, 1:])
+
+   nonzero = [i for i, c in enumerate(coefficients) if c != 0]
+   if not nonzero:
+      return (0,)
+   coefficients = coefficients[nonzero[0]:nonzero[-1] + 1]
+   sign = sum(coefficients) or coefficients[0]
+   if sign < 0:
+      coefficients = [-c for c in coefficients]
+   return tuple(coefficients)
+
+
+def is_alexander_polynomial(coefficients):
+   """return bool, whether coefficients can be the alexander polynomial of a knot.
+
+   Every knot has Delta(t) = Delta(1/t) up to +-t^k, i.e. palindromic
+   coefficients up to sign, and |Delta(1)| = 1, so any polynomial that fails
+   either comes from a broken crossing table or matrix.
+
+   arguments:
+   coefficients - tuple of ints - as returned by alexander_polynomial
+   """
+   reflected = coefficients[::-1]
+   symmetric = reflected == coefficients or reflected == tuple(-c for c in coefficients)
+   return symmetric and abs(sum(coefficients)) == 1
+
+
+def populate_alexander_matrices(underpass_info, ts):
+   """return the alexander matrix at every t in ts, without recompiling the chain.
+
+   Batched version of populate_alexander_matrix: the underpass info is
+   compiled once (see underpass_info_of_chain) and the matrix is built for
+   all values of t in one go. Complex values, such as roots of unity, are
+   fine.
+
+   arguments:
+   underpass_info - numpy array with shape (I, 2) - the output of
+   pre_alexander_compile
+   ts - array-like with shape (T,) - the values of the polynomial parameter
+
+   return value:
+   alex_mats - numpy array with shape (T, I, I)
+   """
+   A0, A1 = alexander_matrix_pencil(underpass_info)
+   ts = np.asarray(ts)[:, np.newaxis, np.newaxis]
+   return A0[np.newaxis] + ts * A1[np.newaxis]
+
+
+def evaluate_alexander_polynomial_batch(underpass_infos, ts):
+   """return Delta(t) for every chain and every t in ts, as float determinants.
+
+   Batched version of evaluate_alexander_polynomial, for many chains compiled
+   once each and evaluated at many t at once. Each entry is the determinant
+   of the first minor, so it is Delta(t) up to a factor of +-t^k: take the
+   absolute value to compare chains, as |Delta(-1)| is the knot determinant
+   and |Delta(w)| at roots of unity w separates more knot types. Use
+   alexander_polynomial instead where exact coefficients are needed.
+
+   arguments:
+   underpass_infos - list of numpy arrays with shape (I, 2) - the output of
+   pre_alexander_compile for each chain
+   ts - array-like with shape (T,) - the values of the polynomial parameter
+
+   return value:
+   dets - numpy array with shape (len(underpass_infos), T), complex if ts is
+   """
+   ts = np.asarray(ts)
+   dets = np.ones((len(underpass_infos), ts.shape[0]), dtype=np.result_type(ts, np.float64))
+   for i, underpass_info in enumerate(underpass_infos):
+      if np.shape(underpass_info)[0] > 1:
+         dets[i] = det(populate_alexander_matrices(underpass_info, ts)[:, 1:, 1:])
+   return dets
+
+
+def roots_of_unity(n):
+   """return numpy array of the n-th roots of unity other than 1, for use as ts."""
+   return np.exp(2j * np.pi * np.arange(1, n) / n)
+
+
+# stages of classify_chain, cheapest first
+CLASSIFIER_STAGES = ("few_crossings", "reidemeister", "determinant")
+
+
+def classify_chain(saw, stats=None, method="brute", reduce=False):
+   """return (alex_poly, stage): the knot determinant of saw and the stage that settled it.
+
+   A staged classifier: most short random chains are unknots, so cheap
+   early exits are tried before paying for the alexander matrix.
+
+      few_crossings - fewer than 3 underpasses in the crossing table, which
+                      only the unknot can have
+      reidemeister  - fewer than 3 crossings left once Reidemeister I and II
+                      moves are undone (see reidemeister_simplify)
+      determinant   - neither, so the alexander matrix and its determinant
+                      at t = -1 are computed, as in basic_monte_carlo_sim
+
+   The crossing table is built once and shared with the last stage. With
+   reduce, saw is first cut down by reduce_polygon, which keeps its knot type
+   but leaves far fewer vertices, and so crossings, for every stage to chew on.
+
+   arguments:
+   saw - numpy array with shape (N+1, 3) - the chain to classify, closed by its
+   first node repeated at the end as generate_closed_chain returns it; without
+   that node the closing edge, and any crossing on it, would be missed
+   stats - collections.Counter - if given, the count of the stage that
+   settled the chain is incremented, so callers can see how much work the
+   early exits skipped
+   method - str - the crossing finder, as in collect_all_intersections
+   reduce - boolean - whether to reduce saw first; the vertex counts before
+   and after are then added to stats under 'vertices' and 'reduced_vertices'
+
+   return value:
+   alex_poly - int - as returned by evaluate_alexander_polynomial, 1 for
+   chains settled early
+   stage - str - one of CLASSIFIER_STAGES
+   """
+   if reduce:
+      reduced = reduce_polygon(saw)
+      if stats is not None:
+         stats["vertices"] += np.shape(saw)[0]
+         stats["reduced_vertices"] += reduced.shape[0]
+      saw = reduced
+
+   rot_saw = rot_saw_xy(saw)
+   proj = find_reg_project(saw)
+   crossing_table = build_crossing_table(proj, rot_saw, method)
+   alex_poly, stage = classify_crossings(rot_saw, proj, crossing_table)
+
+   if stats is not None:
+      stats[stage] += 1
+   return alex_poly, stage
+
+
+def classify_crossings(rot_saw, proj, crossing_table):
+   """return (alex_poly, stage) from an already built crossing table, see classify_chain.
+
+   arguments:
+   rot_saw - numpy array with shape (N, 3) - the rotated chain
+   proj - numpy array with shape (N, 2) - its projection
+   crossing_table - structured numpy array - as built by build_crossing_table
+   """
+   if np.count_nonzero(crossing_table["is_underpass"]) < 3:
+      return 1, "few_crossings"
+   if len(set(reidemeister_simplify(*gauss_code(crossing_table))[0])) < 3:
+      return 1, "reidemeister"
+   underpass_info = pre_alexander_compile(rot_saw, proj, crossing_table=crossing_table)
+   A0, A1 = alexander_matrix_pencil(underpass_info)
+   return evaluate_alexander_polynomial(A0 - A1), "determinant"
+
+
+def format_classifier_stats(stats):
+   """return str, a one line summary of the stage hit rates in stats."""
+   total = sum(stats[stage] for stage in CLASSIFIER_STAGES)
+   summary = ", ".join("{}: {} ({:.1%})".format(stage, stats[stage], stats[stage] / total if total else 0)
+                       for stage in CLASSIFIER_STAGES)
+   if stats["cache_hits"]:
+      summary += ", cache hits: {}".format(stats["cache_hits"])
+   if stats["vertices"]:
+      summary += ", vertices kept by reduction: {} of {} ({:.1%})".format(
+         stats["reduced_vertices"], stats["vertices"], stats["reduced_vertices"] / stats["vertices"])
+   return summary
+
+
+def reduction_report(saw, method="brute"):
+   """return dict of the vertex and crossing counts of saw before and after reduce_polygon.
+
+   The crossings are those the alexander pipeline sees, i.e. the underpasses
+   in the crossing table of the projection find_reg_project gives.
+
+   return value:
+   dict with int values for keys 'vertices', 'reduced_vertices', 'crossings'
+   and 'reduced_crossings'
+   """
+   report = {}
+   for prefix, chain in (("", np.array(saw, dtype=np.float64)),
+                         ("reduced_", reduce_polygon(saw).astype(np.float64))):
+      rot_chain = rot_saw_xy(chain)
+      crossing_table = build_crossing_table(find_reg_project(chain), rot_chain, method)
+      report[prefix + "vertices"] = chain.shape[0]
+      report[prefix + "crossings"] = int(np.count_nonzero(crossing_table["is_underpass"]))
+   return report
@@ -0,0 +1,180 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+from .alexander import alexander_matrix_pencil, evaluate_alexander_polynomial
+from .generate_chain import (chain_rng, generate_chain_helper_pivot,
+                             generate_chain_helper_worm, generate_closed_chain)
+from .private.utilities import build_crossing_table, pre_alexander_compile, rot_saw_xy
+from .projection import find_reg_project
+
+# Times every stage of the chain -> knot pipeline on its own, for each N we
+# have test chains for, and compares the timings against a saved baseline:
+#
+#   python -m app.benchmark --output bench.json
+#   python -m app.benchmark --baseline bench.json
+#
+# Each timing is the median over the chains of N (or over the seeds, for the
+# generation stages) of the best of a few repeats, in seconds per chain.
+
+BENCHMARK_CASES = {8: "app/tests/valid_test_chains_N8.json",
+                   18: "app/tests/valid_test_knots_N_18.json",
+                   30: "app/tests/valid_test_chains_N30.json",
+                   90: "app/tests/valid_test_chains_N90.json",
+                   140: "app/tests/valid_test_chains_N140.json"}
+
+GENERATION_STAGES = ("worm", "pivot", "closure")
+ANALYSIS_STAGES = ("projection", "intersections", "assignment", "determinant")
+STAGES = GENERATION_STAGES + ANALYSIS_STAGES
+
+NUM_SEEDS = 5 # chains generated per N for the generation stages
+PIVOT_MOVES = 1000
+# timings below this many seconds are too noisy to call a regression
+NOISE_FLOOR = 1.0e-4
+
+
+def best_time(func, repeats):
+    """return (seconds, value): the fastest of repeats calls of func, and what it returned."""
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        value = func()
+        best = min(best, time.perf_counter() - start)
+    return best, value
+
+
+def benchmark_generation(N, repeats):
+    """return dict of the per-chain timing of every generation stage for chains of N nodes.
+
+    'closure' is a whole generate_closed_chain call, every failed attempt at
+    closing the chain included; the mean number of attempts it took is
+    returned under 'closure_attempts'.
+    """
+    timings = {stage: [] for stage in GENERATION_STAGES}
+    attempts = []
+    for seed in range(NUM_SEEDS):
+        seed_sequence = np.random.SeedSequence(seed)
+        timings["worm"].append(best_time(
+            lambda: generate_chain_helper_worm(N, rng=chain_rng(seed_sequence)), repeats)[0])
+        timings["pivot"].append(best_time(
+            lambda: generate_chain_helper_pivot(N, PIVOT_MOVES, rng=chain_rng(seed_sequence)),
+            repeats)[0])
+        seconds, chain_and_attempts = best_time(
+            lambda: generate_closed_chain(N, rng=chain_rng(seed_sequence)), repeats)
+        timings["closure"].append(seconds)
+        attempts.append(int(chain_and_attempts['attempts']))
+    result = {stage: float(np.median(seconds)) for stage, seconds in timings.items()}
+    result["closure_attempts"] = float(np.mean(attempts))
+    return result
+
+
+def benchmark_analysis(chains, repeats):
+    """return dict of the per-chain timing of every analysis stage over chains.
+
+    The stages split pre_alexander_compile and its callers as follows:
+
+       projection    - rot_saw_xy and find_reg_project
+       intersections - build_crossing_table, i.e. collecting the intersections
+                       and telling over from under
+       assignment    - underpass types and generators from the crossing table
+       determinant   - the alexander matrix and its determinant at t = -1
+    """
+    timings = {stage: [] for stage in ANALYSIS_STAGES}
+    crossings = []
+    for chain in chains:
+        saw = np.array(chain, dtype=np.float64)
+        seconds, (rot_saw, proj) = best_time(lambda: (rot_saw_xy(saw), find_reg_project(saw)),
+                                             repeats)
+        timings["projection"].append(seconds)
+        seconds, crossing_table = best_time(lambda: build_crossing_table(proj, rot_saw), repeats)
+        timings["intersections"].append(seconds)
+        seconds, underpass_info = best_time(
+            lambda: pre_alexander_compile(rot_saw, proj, crossing_table=crossing_table), repeats)
+        timings["assignment"].append(seconds)
+        timings["determinant"].append(best_time(
+            lambda: evaluate_alexander_polynomial(np.subtract(*alexander_matrix_pencil(underpass_info))),
+            repeats)[0])
+        crossings.append(underpass_info.shape[0])
+    result = {stage: float(np.median(seconds)) for stage, seconds in timings.items()}
+    result["crossings"] = float(np.mean(crossings))
+    return result
+
+
+def run_benchmarks(node_counts=tuple(BENCHMARK_CASES), repeats=3):
+    """return the benchmark results for every N in node_counts, ready to dump as json."""
+    results = {}
+    for N in node_counts:
+        with open(BENCHMARK_CASES[N]) as ifile:
+            chains = json.load(ifile)["tests"]
+        results[str(N)] = dict(benchmark_generation(N, repeats),
+                               **benchmark_analysis(chains, repeats), num_chains=len(chains))
+    return {"python": platform.python_version(), "numpy": np.__version__,
+            "repeats": repeats, "results": results}
+
+
+def compare_to_baseline(current, baseline, tolerance=1.5):
+    """return list of (N, stage, baseline_seconds, current_seconds) for every regression.
+
+    A stage regressed if it got more than tolerance times slower, and by more
+    than NOISE_FLOOR seconds. N or stages missing from either side are skipped.
+    """
+    regressions = []
+    for N, timings in current["results"].items():
+        for stage in STAGES:
+            before = baseline["results"].get(N, {}).get(stage)
+            after = timings.get(stage)
+            if before is None or after is None:
+                continue
+            if after > tolerance * before and after - before > NOISE_FLOOR:
+                regressions.append((N, stage, before, after))
+    return regressions
+
+
+def format_results(current, baseline=None):
+    """return str, a table of the timings in current, next to baseline if given."""
+    lines = ["{:>5} {:<14}{:>14}{:>14}{:>9}".format("N", "stage", "seconds", "baseline", "ratio")]
+    for N, timings in current["results"].items():
+        for stage in STAGES:
+            before = None if baseline is None else baseline["results"].get(N, {}).get(stage)
+            lines.append("{:>5} {:<14}{:>14.3e}{:>14}{:>9}".format(
+                N, stage, timings[stage], "-" if before is None else "{:.3e}".format(before),
+                "-" if not before else "{:.2f}".format(timings[stage] / before)))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """return exit status: 1 if any stage regressed against the baseline, else 0."""
+    parser = argparse.ArgumentParser(description="Time every stage of the chain -> knot pipeline.")
+    parser.add_argument("--nodes", type=int, nargs="+", default=list(BENCHMARK_CASES),
+                        choices=list(BENCHMARK_CASES), help="the values of N to benchmark")
+    parser.add_argument("--repeats", type=int, default=3, help="repeats per timing, best is kept")
+    parser.add_argument("--output", help="file to save the results to, as json")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="slowdown factor counted as a regression")
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(args.nodes, args.repeats)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as ifile:
+            baseline = json.load(ifile)
+    print(format_results(current, baseline))
+    if args.output is not None:
+        with open(args.output, "w") as ofile:
+            json.dump(current, ofile, indent=2)
+
+    if baseline is None:
+        return 0
+    regressions = compare_to_baseline(current, baseline, args.tolerance)
+    for N, stage, before, after in regressions:
+        print("REGRESSION: N = {} {}: {:.3e}s -> {:.3e}s".format(N, stage, before, after))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
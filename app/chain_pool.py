@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from .generate_chain import chain_rng, generate_closed_chain
+from .metrics import emit
+from .private.utilities import chain_to_JSON
+
+# A pool of closed chains generated ahead of time, so that a request for one
+# never waits on the closure rejection loop of generate_closed_chain.
+#
+# Producer threads keep the pool topped up to maxsize, each drawing from its
+# own random stream, and block while it is full. Every entry holds the chain,
+# the attempts it took and its serialized payload, so taking one is a single
+# queue operation. When the pool runs dry the chain is generated inline
+# instead, and counted as a miss.
+DEFAULT_POOL_SIZE = 64
+RATE_WINDOW = 100 # recent refills the refill rate is measured over
+
+
+class ChainPool:
+    """bounded pool of pre-generated closed chains, refilled in the background.
+
+    arguments:
+    num_nodes - int - number of nodes of every chain
+    maxsize - int - the most chains kept ready
+    shift - boolean - as in generate_closed_chain
+    num_producers - int - number of producer threads
+    """
+
+    def __init__(self, num_nodes, maxsize=DEFAULT_POOL_SIZE, shift=True, num_producers=1):
+        self.num_nodes = num_nodes
+        self.shift = shift
+        self.num_producers = num_producers
+        self.entries = queue.Queue(maxsize=maxsize)
+        self.refill_times = deque(maxlen=RATE_WINDOW)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.producers = []
+
+    def start(self):
+        """return self. Start the producer threads, unless they are running already."""
+        with self.lock:
+            if self.producers:
+                return self
+            seed_sequences = np.random.SeedSequence().spawn(self.num_producers)
+            self.producers = [threading.Thread(target=self.produce, args=(seed_sequence,),
+                                               name="chain-pool-{}".format(i), daemon=True)
+                              for i, seed_sequence in enumerate(seed_sequences)]
+        for producer in self.producers:
+            producer.start()
+        return self
+
+    def stop(self, timeout=None):
+        """return None. Stop the producer threads once their current chain is done."""
+        self.stopping.set()
+        for producer in self.producers:
+            producer.join(timeout)
+
+    def make_entry(self, rng=None):
+        """return (chain, attempts, payload) for a freshly generated chain."""
+        chain_and_attempts = generate_closed_chain(self.num_nodes, shift=self.shift, rng=rng)
+        chain = chain_and_attempts['chain']
+        return chain, int(chain_and_attempts['attempts']), chain_to_JSON(chain)
+
+    def produce(self, seed_sequence):
+        rng = chain_rng(seed_sequence)
+        while not self.stopping.is_set():
+            entry = self.make_entry(rng)
+            while not self.stopping.is_set():
+                try:
+                    self.entries.put(entry, timeout=0.5)
+                except queue.Full:
+                    continue
+                with self.lock:
+                    self.refill_times.append(time.monotonic())
+                break
+
+    def get(self):
+        """return (chain, attempts, payload), from the pool if it holds one.
+
+        Never blocks on the producers: an empty pool means generating the chain
+        right here, as without a pool.
+        """
+        try:
+            entry = self.entries.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                self.misses += 1
+            emit("chain_pool_miss", num_nodes=self.num_nodes)
+            return self.make_entry()
+        with self.lock:
+            self.hits += 1
+        return entry
+
+    def refill_rate(self):
+        """return chains per second added to the pool, over the recent refills."""
+        with self.lock:
+            if len(self.refill_times) < 2:
+                return 0.0
+            return (len(self.refill_times) - 1) / (self.refill_times[-1] - self.refill_times[0])
+
+    def stats(self):
+        """return dict of the pool depth, capacity, refill rate, hits and misses."""
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        return {"depth": self.entries.qsize(), "maxsize": self.entries.maxsize,
+                "refill_rate": self.refill_rate(), "hits": hits, "misses": misses,
+                "producers": sum(producer.is_alive() for producer in self.producers)}
@@ -0,0 +1,103 @@
+import fcntl
+import os
+
+import numpy as np
+
+from .private.utilities import chains_to_codes, codes_to_chains
+
+# A chain store is a directory holding two flat binary files:
+#
+#   codes.bin - the int8 step codes (see CODE_DIRECTIONS) of every chain, one
+#               chain after the other
+#   index.bin - one INDEX_DTYPE record per chain: where its codes start in
+#               codes.bin, how many steps it has, and the attempts it took
+#
+# Both files are only ever appended to, codes first and index second, so a
+# chain exists once its index record is fully written and a crash mid-append
+# never leaves a half-written chain visible. Appends hold an exclusive lock on
+# codes.bin from reading its size to writing the index, so writers in other
+# threads or processes (a job worker and the chain pool, say) cannot claim
+# the same offset. Neither file needs parsing: both
+# are read straight through np.memmap. One step is one byte, so a million
+# chains of 100 links take about 100MB plus 16MB of index.
+CODES_FILE = "codes.bin"
+INDEX_FILE = "index.bin"
+INDEX_DTYPE = np.dtype([('offset', '<i8'), ('num_steps', '<i4'), ('attempts', '<u4')])
+
+
+def append_chains(path, chains, attempts=None):
+    """return None. Append chains to the chain store in directory path.
+
+    The store is created if it does not exist yet. All chains of one call are
+    written as a single chunk.
+
+    arguments:
+    path - str or Path - the directory of the chain store
+    chains - numpy array with shape (M, n+1, 3), or a structured array with
+    fields 'chain' and 'attempts' as returned by generate_closed_chain and
+    generate_closed_chains_batch
+    attempts - numpy array of ints with shape (M,) - the attempts each chain
+    took, taken from chains when it is structured and 0 otherwise
+    """
+    chains = np.asarray(chains)
+    if chains.dtype.names is not None:
+        attempts = chains['attempts'] if attempts is None else attempts
+        chains = chains['chain']
+    chains = chains.reshape((-1,) + chains.shape[-2:])
+    attempts = np.zeros(chains.shape[0]) if attempts is None else np.ravel(attempts)
+
+    codes = chains_to_codes(chains)
+    os.makedirs(path, exist_ok=True)
+    index = np.empty(chains.shape[0], dtype=INDEX_DTYPE)
+    index['num_steps'] = codes.shape[1]
+    index['attempts'] = attempts
+
+    with open(os.path.join(path, CODES_FILE), "ab") as codes_file:
+        fcntl.flock(codes_file, fcntl.LOCK_EX) # released when the file is closed
+        start = codes_file.seek(0, os.SEEK_END)
+        index['offset'] = start + codes.shape[1] * np.arange(chains.shape[0])
+        codes_file.write(codes.tobytes())
+        codes_file.flush()
+        with open(os.path.join(path, INDEX_FILE), "ab") as index_file:
+            index_file.write(index.tobytes())
+
+
+def open_chains(path):
+    """return (codes, index), memory-mapped views of the chain store in path.
+
+    Nothing is read until it is indexed. The codes of chain i are
+    codes[index['offset'][i]:index['offset'][i] + index['num_steps'][i]].
+    Index records not fully written yet are left out.
+    """
+    index_path = os.path.join(path, INDEX_FILE)
+    num_chains = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+    if num_chains == 0:
+        return np.empty(0, dtype=np.int8), np.empty(0, dtype=INDEX_DTYPE)
+    index = np.memmap(index_path, dtype=INDEX_DTYPE, mode='r', shape=(num_chains,))
+    codes = np.memmap(os.path.join(path, CODES_FILE), dtype=np.int8, mode='r')
+    return codes, index
+
+
+def iter_chains(path, batch_size=10000, num_steps=None):
+    """yield batches of chains and attempts from the chain store in path.
+
+    Chains are decoded batch_size at a time, so a whole corpus can be streamed
+    without ever holding it in memory. Each batch only holds chains of one
+    length, and num_steps restricts the stream to chains with that many steps.
+
+    yield value:
+    chains - numpy array with shape (B, n+1, 3) - the decoded chains
+    attempts - numpy array with shape (B,) - the attempts each chain took
+    """
+    codes, index = open_chains(path)
+    if num_steps is not None:
+        selected = np.nonzero(index['num_steps'] == num_steps)[0]
+    else:
+        selected = np.arange(index.shape[0])
+
+    for start in range(0, selected.shape[0], batch_size):
+        batch = index[selected[start:start + batch_size]]
+        for n in np.unique(batch['num_steps']):
+            records = batch[batch['num_steps'] == n]
+            positions = records['offset'][:, np.newaxis] + np.arange(n)
+            yield codes_to_chains(codes[positions]), np.array(records['attempts'])
@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from .alexander import classify_chain
+from .private.utilities import canonical_codes, codes_to_chains
+
+# A classification cache maps the canonical step codes of a chain (see
+# canonical_codes) to the (alex_poly, stage) classify_chain gives it, so a
+# chain met again, in whatever position, orientation or starting node, is
+# never classified twice.
+#
+# The memory tier is an LRU dict of at most maxsize entries. The optional disk
+# tier is an SQLite file, which outlives the process and is shared by every
+# process pointed at it, such as the workers of basic_monte_carlo_sim.
+#
+# On a miss it is the chain decoded from the canonical codes that gets
+# classified, not the chain passed in, so the result only depends on the key
+# and every copy of a chain is classified identically.
+DEFAULT_MAXSIZE = 1 << 16
+# part of every key, bumped whenever classify_chain changes its answers so
+# that entries of a disk tier filled by an older version are never hit
+CACHE_VERSION = 2
+TABLE_SCHEMA = """CREATE TABLE IF NOT EXISTS classifications (
+                      key TEXT PRIMARY KEY, alex_poly INTEGER, stage TEXT)"""
+
+
+class ClassificationCache:
+    """two tier cache of classify_chain results, keyed by canonical chain.
+
+    The cache pickles as its settings only, so handing it to worker processes
+    gives each of them an empty memory tier over the same disk tier.
+
+    arguments:
+    maxsize - int - the most entries kept in memory
+    path - str or Path - the SQLite file of the disk tier, or None for none
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            with self.connection:
+                self.connection.execute(TABLE_SCHEMA)
+
+    def __getstate__(self):
+        return {"maxsize": self.maxsize, "path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(chain, method="brute", reduce=False):
+        """return str key of chain, for a given setting of classify_chain."""
+        return "v{}:{}:{:d}:{}".format(CACHE_VERSION, method, reduce,
+                                       canonical_codes(chain).tobytes().hex())
+
+    def get(self, key):
+        """return (alex_poly, stage) stored under key, or None if there is none."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            if self.connection is None:
+                return None
+            row = self.connection.execute(
+                "SELECT alex_poly, stage FROM classifications WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._remember(key, tuple(row))
+        return None if row is None else tuple(row)
+
+    def put(self, key, value):
+        """return None. Store value, i.e. (alex_poly, stage), under key in both tiers."""
+        self._remember(key, value)
+        if self.connection is not None:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO classifications VALUES (?, ?, ?)",
+                    (key, int(value[0]), value[1]))
+
+    def _remember(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def classify(self, chain, stats=None, method="brute", reduce=False):
+        """return (alex_poly, stage) of chain, as classify_chain, from the cache if possible.
+
+        arguments:
+        chain - numpy array with shape (N+1, 3) - a closed lattice chain, with
+        its first node repeated at the end as generate_closed_chain returns it
+        stats - collections.Counter - as in classify_chain; hits are counted
+        under 'cache_hits' instead of under a stage
+        method, reduce - as in classify_chain
+        """
+        key = self.key(chain, method, reduce)
+        value = self.get(key)
+        if value is not None:
+            if stats is not None:
+                stats["cache_hits"] += 1
+            return value
+
+        canonical_chain = codes_to_chains(canonical_codes(chain))
+        alex_poly, stage = classify_chain(canonical_chain, stats, method, reduce)
+        value = (int(alex_poly), stage)
+        self.put(key, value)
+        return value
+
+    def close(self):
+        """return None. Close the disk tier, the memory tier stays usable."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -1,9 +1,11 @@
 import numpy as np
 from math import isclose
 from numpy.linalg import norm
-from scipy.spatial.distance import cdist
+
+from .chain_store import append_chains
+from .metrics import instrument
 from .private.generate_binary_list import gen_all_bin_list
-from .private.utilities import pivot_rotations
+from .private.utilities import LatticeOccupancy, lattice_symmetry_group
 
 dirs = gen_all_bin_list(3) # all possible directions in cubic lattice
 
@@ -12,7 +14,7 @@ np.random.seed(0)
 
 # NOTE: generates a chain according to the probability dist. Does not test if
 # is closed nor whether is self-intersecting.
-def generate_chain_helper_worm(N, shift=False):
+def generate_chain_helper_worm(N, shift=False, rng=None):
     """return a random walk 'chain' with N nodes.
     
     The method uses the 'worm in an apple' approach to generate the chain,
@@ -24,81 +26,194 @@ def generate_chain_helper_worm(N, shift=False):
     
     arguments:
     N - int - the length of the desired chain
+    rng - numpy RandomState - the random stream to draw from, defaults to the
+    global numpy one
     
     return value:
     chain - numpy array of nodes with shape (N, 3) - the generated random walk
     """
+    rng = np.random if rng is None else rng
     chain = np.zeros((N, 3))
     node = chain[0]
     dir = np.zeros(3) 
+    occupied = LatticeOccupancy([node])
 
     for i in np.arange(1, N):
         probs = special_prob_dist(N - i, node, dirs)
-        dir = dirs[np.random.choice(dirs.shape[0], p=probs)]
+        dir = dirs[rng.choice(dirs.shape[0], p=probs)]
         new_node = np.add(node, dir)
 
-        j = 0
-        while any(np.equal(chain[:i], new_node).all(1)):
+        if new_node in occupied:
             # before doing anything, check whether we are locked out (think snake)
-            surrounding = dirs + node
-            chain_as_set = {tuple(node) for node in chain[:i]}
-            surrounding_as_set = {tuple(node) for node in surrounding}
-            if chain_as_set.intersection(surrounding_as_set) is surrounding_as_set:
+            remaining_surrounding = occupied.free_neighbours(node, dirs)
+            if not remaining_surrounding:
                 return None # No remaining dirs to choose from: give up this attempt
-            remaining_surrounding = np.array(list(surrounding_as_set.difference(chain_as_set)))
-            new_node = remaining_surrounding[np.random.choice(remaining_surrounding.shape[0])]
-
-            j += 1
-            if j == 10000:
-                print("probs: {} and node {}\nchain: {}".format(probs, i, chain))
+            new_node = remaining_surrounding[rng.choice(len(remaining_surrounding))]
 
         chain[i] = new_node
+        occupied.add(new_node, i)
         node = new_node
     
     return chain
 
 
-def v_dot(a): return lambda b: np.dot(a,b)
+#alg from: https://biophyenvpol.wordpress.com/2014/11/13/pivot-algorithm-of-self-avoiding-chain-using-python-and-cython/
+def generate_chain_helper_pivot(N, num_it, rng=None, chain=None):
+    """return a self-avoiding walk with N nodes after num_it pivot moves.
 
+    Each move picks a pivot node, one side of the chain and one of the 47
+    non-trivial lattice symmetries, and applies the symmetry to that side about
+    the pivot. The move is rejected if any moved node lands on the fixed side.
+    The chain is kept as integer lattice coordinates and updated in place,
+    and clashes are looked up in a LatticeOccupancy, walking outwards from the
+    pivot (where clashes are most likely) and stopping at the first one.
 
-#alg from: https://biophyenvpol.wordpress.com/2014/11/13/pivot-algorithm-of-self-avoiding-chain-using-python-and-cython/
-def generate_chain_helper_pivot(N, num_it):
-    rotate_matrices = np.array([[[1,0,0],[0,0,-1],[0,1,0]],[[1,0,0],[0,-1,0],[0,0,-1]]
-        ,[[1,0,0],[0,0,1],[0,-1,0]],[[0,0,1],[0,1,0],[-1,0,0]]
-        ,[[-1,0,0],[0,1,0],[0,0,-1]],[[0,0,-1],[0,1,0],[-1,0,0]]
-        ,[[0,-1,0],[1,0,0],[0,0,1]],[[-1,0,0],[0,-1,0],[0,0,1]]
-        ,[[0,1,0],[-1,0,0],[0,0,1]]])
-
-    chain = np.dstack((np.arange(N), np.zeros(N), np.zeros(N)))[0]
-
-    for i in np.arange(num_it):
-        pivot = np.random.randint(1, N-1)
-        side = np.random.choice([-1,1])
-
-        if side == 1:
-            old_chain = chain[0:pivot+1]
-            temp_chain = chain[pivot+1:]
-        else:
-            old_chain = chain[pivot:]
-            temp_chain = chain[0:pivot]
-        
-        sym_op = rotate_matrices[np.random.randint(len(rotate_matrices))] # TODO: change all other examples of this to len
-        new_chain = np.apply_along_axis(v_dot(sym_op), 1, temp_chain - chain[pivot]) + chain[pivot]
+    arguments:
+    N - int - the length of the desired chain
+    num_it - int - the number of pivot moves to attempt
+    rng - numpy RandomState - the random stream to draw from, defaults to the
+    global numpy one
+    chain - numpy array with shape (N, 3) - the self-avoiding walk to start
+    from, defaults to a rod along (1, 1, 1)
+
+    return value:
+    chain - numpy array of nodes with shape (N, 3) - the walk, with chain[0]
+    at the origin
+    """
+    rng = np.random if rng is None else rng
+    symmetries = lattice_symmetry_group()
+
+    if chain is None:
+        chain = np.outer(np.arange(N), np.ones(3, dtype=np.int64))
+    else:
+        chain = np.array(chain, dtype=np.int64)
+    occupied = LatticeOccupancy(chain)
+    sites = occupied.sites
+    keys = LatticeOccupancy.pack_array(chain)
+    # packing is linear in the coordinates, so the key of pivot + sym_op @ rel
+    # is the key of the pivot plus rel @ key_weights[sym_op]
+    key_weights = symmetries.transpose(0, 2, 1) @ LatticeOccupancy.KEY_WEIGHTS
 
-        overlap = cdist(new_chain, old_chain)
-        overlap = overlap.flatten()
+    # draw all the moves up front
+    pivots = rng.randint(1, N-1, size=num_it)
+    sides = rng.randint(2, size=num_it)
+    sym_ops = rng.randint(len(symmetries), size=num_it)
 
-        if len(np.nonzero(overlap)[0]) != len(overlap):
+    for pivot, side, sym_op in zip(pivots.tolist(), sides.tolist(), sym_ops.tolist()):
+        # the moving part of the chain, ordered outwards from the pivot
+        moving = slice(pivot+1, N) if side == 1 else slice(pivot-1, None, -1)
+        rel = chain[moving] - chain[pivot]
+        new_keys = (rel @ key_weights[sym_op] + keys[pivot]).tolist()
+
+        clash = False
+        for key in new_keys:
+            position = sites.get(key)
+            # landing on a site the moving part itself vacates is fine
+            if position is not None and (position <= pivot if side == 1 else position >= pivot):
+                clash = True
+                break
+        if clash:
             continue
-        else:
-            if side == 1:
-                chain = np.concatenate((old_chain, new_chain), axis=0)
-            elif side == -1:
-                chain = np.concatenate((new_chain, old_chain), axis=0)
+
+        for key in keys[moving].tolist():
+            del sites[key]
+        sites.update(zip(new_keys, range(pivot+1, N) if side == 1 else range(pivot-1, -1, -1)))
+        keys[moving] = new_keys
+        chain[moving] = rel @ symmetries[sym_op].T + chain[pivot]
 
     chain -= chain[0]
-    # May not want to use this method, very low prob of closing...
-    return chain
+    # May not want to use this method for closed chains, very low prob of closing...
+    return chain.astype(np.float64)
+
+
+def generate_chain_helper_polygon(N, num_it, rng=None, chain=None, stats=None):
+    """return a closed self-avoiding polygon with N nodes after num_it polygon moves.
+
+    Unlike the worm and pivot helpers, every chain produced here is closed, so
+    nothing is ever thrown away. We start from a closed ring (a lattice
+    parallelogram) and apply polygon pivot moves (Madras, Orlitsky and Shepp):
+    pick two nodes v_i and v_j, and replace the arc between them by its image
+    under a lattice symmetry g fixing v_j - v_i, about v_i, optionally walking
+    the arc backwards (an inversion). Both ends stay put, so the polygon stays
+    closed, and the move is rejected if the new arc lands on the rest of the
+    polygon. The moves are symmetric, so unlike the worm the polygons tend to
+    the uniform distribution over self-avoiding polygons.
+
+    arguments:
+    N - int - the length of the desired chain, must be even and at least 4
+    num_it - int - the number of polygon moves to attempt
+    rng - numpy RandomState - the random stream to draw from, defaults to the
+    global numpy one
+    chain - numpy array with shape (N, 3) - the closed polygon to start from,
+    defaults to a parallelogram
+    stats - Counter - if given, "polygon_moves" is incremented by num_it and
+    "polygon_moves_accepted" by the number of moves that changed the polygon
+    (the identity and moves that land on the polygon are not accepted)
+
+    return value:
+    chain - numpy array of nodes with shape (N, 3) - the polygon, with chain[0]
+    at the origin and chain[-1] one link away from it
+    """
+    if N < 4 or N % 2:
+        raise ValueError("closed chains need an even number of nodes, at least 4, got {}".format(N))
+    rng = np.random if rng is None else rng
+    symmetries = np.concatenate((np.eye(3, dtype=np.int64)[np.newaxis],
+                                 lattice_symmetry_group()))
+
+    if chain is None:
+        # parallelogram with sides k * (1, 1, 1) and l * (1, -1, -1)
+        k = N // 4
+        steps = np.array([[1, 1, 1]] * k + [[1, -1, -1]] * (N//2 - k) +
+                         [[-1, -1, -1]] * k + [[-1, 1, 1]] * (N//2 - k - 1))
+        chain = np.concatenate((np.zeros((1, 3), dtype=np.int64), np.cumsum(steps, axis=0)))
+    else:
+        chain = np.array(chain, dtype=np.int64)
+    occupied = LatticeOccupancy(chain)
+    sites = occupied.sites
+
+    # draw all the moves up front
+    starts = rng.randint(N, size=num_it)
+    arc_lengths = rng.randint(1, N-1, size=num_it) # nodes strictly between v_i and v_j
+    reverses = rng.randint(2, size=num_it)
+    sym_draws = rng.random_sample(num_it)
+    accepted = 0
+
+    for i, arc_length, reverse, sym_draw in zip(starts.tolist(), arc_lengths.tolist(),
+                                                reverses.tolist(), sym_draws.tolist()):
+        j = (i + arc_length + 1) % N
+        arc = (i + 1 + np.arange(arc_length)) % N
+        stabilizer = np.nonzero(np.all(symmetries @ (chain[j] - chain[i]) ==
+                                       chain[j] - chain[i], axis=1))[0]
+        sym_op = stabilizer[int(sym_draw * stabilizer.shape[0])]
+        if sym_op == 0 and not reverse:
+            continue # the identity
+
+        if reverse:
+            new_nodes = chain[i] + (chain[j] - chain[arc[::-1]]) @ symmetries[sym_op].T
+        else:
+            new_nodes = chain[i] + (chain[arc] - chain[i]) @ symmetries[sym_op].T
+        new_keys = LatticeOccupancy.pack_array(new_nodes).tolist()
+
+        clash = False
+        for key in new_keys:
+            position = sites.get(key)
+            # landing on a site the arc itself vacates is fine
+            if position is not None and not 0 < (position - i) % N <= arc_length:
+                clash = True
+                break
+        if clash:
+            continue
+
+        for key in LatticeOccupancy.pack_array(chain[arc]).tolist():
+            del sites[key]
+        sites.update(zip(new_keys, arc.tolist()))
+        chain[arc] = new_nodes
+        accepted += 1
+
+    if stats is not None:
+        stats["polygon_moves"] += num_it
+        stats["polygon_moves_accepted"] += accepted
+    return (chain - chain[0]).astype(np.float64)
 
 
 def special_prob_dist(n, node, dirs):
@@ -144,16 +259,66 @@ def special_prob_dist(n, node, dirs):
     return probs
 
 
-def generate_closed_chain(N, shift=True, num_it=1000, pivot=False):
+def special_prob_dist_batch(n, nodes, dirs):
+    """return array of probs for all possible directions, for many walkers.
+
+    Array version of special_prob_dist, giving the same distribution for every
+    walker at once.
+
+    arguments:
+    n - numpy array of ints with shape (B,) - the remaining length of each chain
+    nodes - numpy array with shape (B, 3) - the current node of each walker
+    dirs - numpy array with shape (8, 3) - set of all directions in 
+    body-centered lattice
+
+    return value:
+    probs - numpy array with shape (B, 8) - probabilities associated with dirs
+    for each walker
+    """
+    n = n[:, np.newaxis, np.newaxis]
+    factors = (n - dirs[np.newaxis] * nodes[:, np.newaxis]) / (2 * n)
+    probs = np.prod(factors, axis=2)
+    # a negative factor anywhere zeroes the probability, as in special_prob_dist
+    probs[np.any(factors < 0, axis=2)] = 0
+    return probs / np.sum(probs, axis=1)[:, np.newaxis]
+
+
+def chain_rng(seed_sequence):
+    """return an independent RandomState drawing from the given SeedSequence.
+
+    Used to give every chain of a simulation its own reproducible stream, so
+    that the chains do not depend on the global seed set above nor on which
+    process generates them.
+    """
+    return np.random.RandomState(np.random.MT19937(seed_sequence))
+
+
+@instrument("generate_closed_chain",
+            counts=lambda result: {"chains": 1, "closure_attempts": int(result['attempts'])})
+def generate_closed_chain(N, shift=True, num_it=1000, pivot=False, polygon=False, rng=None,
+                          store=None, stats=None):
+    """return a closed chain with N nodes and the number of attempts it took.
+
+    The chain is grown by the worm helper by default, or by the pivot helper
+    if pivot is set, and attempts are repeated until one happens to close. With
+    polygon set, the polygon helper produces a closed chain directly, so
+    attempts is always 1 and is only reported for the sake of comparison; the
+    polygon move counts are added to stats instead, if given (see
+    generate_chain_helper_polygon).
+    If store is given, the chain is also appended to the chain store in that
+    directory (see chain_store).
+    """
     chain = None
     attempts = 0
 
     while True:
         
-        if pivot:
-            chain = generate_chain_helper_pivot(N, num_it)
+        if polygon:
+            chain = generate_chain_helper_polygon(N, num_it, rng, stats=stats)
+        elif pivot:
+            chain = generate_chain_helper_pivot(N, num_it, rng)
         else:
-            chain = generate_chain_helper_worm(N, shift)
+            chain = generate_chain_helper_worm(N, shift, rng)
         
         attempts += 1
         if is_closed(chain):
@@ -165,7 +330,120 @@ def generate_closed_chain(N, shift=True, num_it=1000, pivot=False):
     # else do we need this node?) 
     chain = np.append(chain, np.array([chain[0]]), axis=0)
     dtype = [('chain', np.float64, (N+1,3)), ('attempts', np.uintc)]
-    return np.array((chain.tolist(), attempts), dtype=dtype)
+    result = np.array((chain.tolist(), attempts), dtype=dtype)
+    if store is not None:
+        append_chains(store, result)
+    return result
+
+
+def generate_closed_chains_batch(N, num_chains, batch_size=1024, rng=None, store=None):
+    """return num_chains closed chains, grown by many worm walkers at once.
+
+    Batched version of generate_closed_chain with the worm method: batch_size
+    independent walkers are advanced together as a (B, N, 3) array, each step
+    drawn from special_prob_dist_batch. Every walker keeps the packed sites it
+    occupies in a set of its own (see LatticeOccupancy), so telling whether a
+    step runs into the walker takes constant time. A walker which runs into
+    itself moves to a random free neighbour instead, as in
+    generate_chain_helper_worm, and is dropped if it is locked out. Dropped and finished walkers are refilled
+    with fresh attempts, and only the closed chains are kept.
+
+    Every walker started is an attempt, numbered in the order it was started.
+    Once enough chains have closed we stop refilling and let the running
+    walkers finish, so that the attempts of the i-th closed chain are counted
+    exactly as generate_closed_chain would: the number of attempts since the
+    previous closed chain.
+
+    arguments:
+    N - int - the length of the desired chains
+    num_chains - int - the number of closed chains to return
+    batch_size - int - the number of walkers advanced together
+    rng - numpy RandomState - the random stream to draw from, defaults to the
+    global numpy one
+    store - str or Path - if given, the chains are also appended to the chain
+    store in that directory (see chain_store)
+
+    return value:
+    structured numpy array with shape (num_chains,) and the same fields as
+    generate_closed_chain: 'chain' with shape (N+1, 3) and 'attempts'
+    """
+    rng = np.random if rng is None else rng
+    int_dirs = dirs.astype(np.int64)
+    origin = LatticeOccupancy.pack((0, 0, 0))
+
+    chains = np.zeros((batch_size, N, 3), dtype=np.int64)
+    length = np.ones(batch_size, dtype=np.int64) # nodes placed so far
+    attempt = np.arange(batch_size)              # the attempt each walker runs
+    next_attempt = batch_size
+    occupied = [{origin} for _ in range(batch_size)] # packed sites of every walker
+    closed_attempts, closed_chains = [], []
+
+    while length.shape[0] > 0:
+        walkers = np.arange(length.shape[0])
+        nodes = chains[walkers, length - 1]
+
+        # draw the next direction of every walker from its own distribution
+        probs = special_prob_dist_batch(N - length, nodes, int_dirs)
+        choice = np.sum(rng.random_sample(walkers.shape[0])[:, np.newaxis] >
+                        np.cumsum(probs, axis=1)[:, :-1], axis=1)
+        new_nodes = nodes + int_dirs[choice]
+
+        # self-avoidance: collided walkers move to a random free neighbour
+        new_keys = LatticeOccupancy.pack_array(new_nodes).tolist()
+        collided = np.array([key in sites for key, sites in zip(new_keys, occupied)], dtype=bool)
+        locked_out = np.zeros(walkers.shape[0], dtype=bool)
+        if np.any(collided):
+            surrounding = nodes[collided, np.newaxis] + int_dirs  # (C, 8, 3)
+            surrounding_keys = LatticeOccupancy.pack_array(surrounding).tolist()
+            taken = np.array([[key in occupied[i] for key in keys] for i, keys
+                              in zip(np.nonzero(collided)[0], surrounding_keys)],
+                             dtype=bool).reshape(-1, int_dirs.shape[0])  # (C, 8)
+            num_free = np.sum(~taken, axis=1)
+            pick = np.floor(rng.random_sample(num_free.shape[0]) * num_free)
+            pick = np.argmax(np.cumsum(~taken, axis=1) > pick[:, np.newaxis], axis=1)
+            new_nodes[collided] = surrounding[np.arange(pick.shape[0]), pick]
+            locked_out[collided] = num_free == 0
+            new_keys = LatticeOccupancy.pack_array(new_nodes).tolist()
+
+        chains[walkers, length] = new_nodes
+        for sites, key in zip(occupied, new_keys):
+            sites.add(key)
+        length += 1
+
+        # harvest finished walkers, a chain is closed when its ends are one link apart
+        finished = locked_out | (length == N)
+        is_closed_walker = ~locked_out & np.all(np.abs(chains[:, -1] - chains[:, 0]) == 1, axis=1)
+        for i in np.nonzero(finished)[0]:
+            if is_closed_walker[i]:
+                closed_attempts.append(attempt[i])
+                closed_chains.append(chains[i].copy())
+
+        # refill with fresh attempts, or drop once enough chains have closed
+        num_finished = np.count_nonzero(finished)
+        if len(closed_chains) < num_chains:
+            chains[finished] = 0
+            length[finished] = 1
+            for i in np.nonzero(finished)[0]:
+                occupied[i] = {origin}
+            attempt[finished] = np.arange(next_attempt, next_attempt + num_finished)
+            next_attempt += num_finished
+        else:
+            chains, length, attempt = chains[~finished], length[~finished], attempt[~finished]
+            occupied = [occupied[i] for i in np.nonzero(~finished)[0]]
+
+    order = np.argsort(closed_attempts)[:num_chains]
+    closed_attempts = np.array(closed_attempts)[order]
+    attempts = np.diff(closed_attempts, prepend=-1)
+
+    closed = np.array(closed_chains)[order].astype(np.float64)
+    closed = np.concatenate((closed, closed[:, :1]), axis=1)
+    dtype = [('chain', np.float64, (N+1,3)), ('attempts', np.uintc)]
+    result = np.empty(num_chains, dtype=dtype)
+    result['chain'] = closed
+    result['attempts'] = attempts
+    if store is not None:
+        append_chains(store, result)
+    return result
 
 
 SQRT_3 = 1.7320508075688772  # the distance between each link
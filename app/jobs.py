@@ -0,0 +1,395 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from .metrics import emit
+from .monte_carlo import SIMULATION_CONDITIONS
+from .pipeline import (MAX_CHAINS_PER_REQUEST, MAX_NODES, RunningStats, load_checkpoint,
+                       stream_monte_carlo)
+
+# Background jobs for monte carlo runs too long to serve within a request.
+#
+# Jobs live in a SQLite file under jobs_root, so they outlive the process:
+# queued jobs are picked up by the next JobManager on the same root, and jobs
+# left running by a crashed process are queued again once their heartbeat is
+# older than STALE_SECONDS. Worker threads claim queued jobs one at a time.
+#
+# Every claim stamps the job with a fresh token, and only the holder of the
+# current token can beat for the job or record its outcome. A runner whose
+# job was cancelled, or requeued and claimed by someone else, finds out at
+# its next heartbeat and stops. The heartbeat comes from a thread of its own,
+# so a job stays alive through chains, or a process pool start-up, of any
+# length.
+#
+# A sweep job runs every (N, number of chains) cell of its conditions through
+# stream_monte_carlo, with a checkpoint directory per cell under the job's own
+# directory, so a restarted sweep skips the finished cells and resumes the
+# interrupted one where its checkpoint left off.
+JOBS_DB = "jobs.sqlite"
+JOB_STATUSES = ("queued", "running", "done", "failed", "cancelled")
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+JOB_KINDS = ("sweep",)
+HEARTBEAT_SECONDS = 2.0 # time between heartbeats, and progress updates, of a running job
+STALE_SECONDS = 30.0 # a running job silent for this long belongs to a dead process
+POLL_SECONDS = 0.5 # time idle workers wait between looks at the queue
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    token TEXT)"""
+
+
+class JobStore:
+    """jobs, their status, progress and results, kept in the SQLite file at path.
+
+    Every operation opens its own connection, so a store can be shared by
+    threads, and by processes on the same file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute(SCHEMA)
+                columns = [row["name"] for row in connection.execute("PRAGMA table_info(jobs)")]
+                if "token" not in columns: # a store made before claims had tokens
+                    connection.execute("ALTER TABLE jobs ADD COLUMN token TEXT")
+        finally:
+            connection.close()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30.0)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def execute(self, sql, *args):
+        """return the rows of sql, run in a transaction of its own."""
+        connection = self.connect()
+        try:
+            with connection:
+                return connection.execute(sql, args).fetchall()
+        finally:
+            connection.close()
+
+    def execute_count(self, sql, *args):
+        """return int, the number of rows sql changed, run in a transaction of its own."""
+        connection = self.connect()
+        try:
+            with connection:
+                return connection.execute(sql, args).rowcount
+        finally:
+            connection.close()
+
+    def submit(self, kind, params):
+        """return str, the id of a new queued job of kind with params."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.execute("INSERT INTO jobs (id, kind, params, status, created, updated) "
+                     "VALUES (?, ?, ?, 'queued', ?, ?)", job_id, kind, json.dumps(params), now, now)
+        return job_id
+
+    def claim(self):
+        """return the oldest queued job, marked running, or None if none is queued.
+
+        The job comes with the 'token' of this claim, which heartbeat and
+        finish need.
+        """
+        token = uuid.uuid4().hex
+        connection = self.connect()
+        try:
+            with connection:
+                # BEGIN IMMEDIATE: no other claim can pick the same job in between
+                connection.execute("BEGIN IMMEDIATE")
+                row = connection.execute("SELECT id FROM jobs WHERE status = 'queued' "
+                                         "ORDER BY created LIMIT 1").fetchone()
+                if row is None:
+                    return None
+                connection.execute("UPDATE jobs SET status = 'running', token = ?, updated = ? "
+                                   "WHERE id = ?", (token, time.time(), row["id"]))
+        finally:
+            connection.close()
+        return dict(self.get(row["id"]), token=token)
+
+    def get(self, job_id):
+        """return dict of the job job_id, or None if there is no such job."""
+        rows = self.execute("SELECT * FROM jobs WHERE id = ?", job_id)
+        return None if not rows else job_to_dict(rows[0])
+
+    def list(self):
+        """return list of the dicts of every job, oldest first."""
+        return [job_to_dict(row) for row in self.execute("SELECT * FROM jobs ORDER BY created")]
+
+    def heartbeat(self, job_id, token, progress=None):
+        """return bool, whether the claim token on job_id still holds. Saves progress if given."""
+        if progress is None:
+            return self.execute_count(
+                "UPDATE jobs SET updated = ? WHERE id = ? AND token = ? AND status = 'running'",
+                time.time(), job_id, token) == 1
+        return self.execute_count(
+            "UPDATE jobs SET updated = ?, progress = ? "
+            "WHERE id = ? AND token = ? AND status = 'running'",
+            time.time(), json.dumps(progress), job_id, token) == 1
+
+    def finish(self, job_id, token, status, result=None, error=None):
+        """return bool, whether the claim token on job_id still held and status was recorded.
+
+        status 'queued' hands the job back to the queue, dropping the claim.
+        """
+        return self.execute_count(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated = ?, "
+            "token = CASE WHEN ? = 'queued' THEN NULL ELSE token END "
+            "WHERE id = ? AND token = ? AND status = 'running'",
+            status, None if result is None else json.dumps(result), error, time.time(), status,
+            job_id, token) == 1
+
+    def cancel(self, job_id):
+        """return bool, whether job_id was queued or running and is now cancelled."""
+        return self.execute_count(
+            "UPDATE jobs SET status = 'cancelled', updated = ? "
+            "WHERE id = ? AND status IN ('queued', 'running')", time.time(), job_id) == 1
+
+    def requeue_stale(self, stale_seconds=STALE_SECONDS):
+        """return int, the number of running jobs without a heartbeat for stale_seconds, requeued."""
+        return self.execute_count(
+            "UPDATE jobs SET status = 'queued', token = NULL "
+            "WHERE status = 'running' AND updated < ?", time.time() - stale_seconds)
+
+
+def job_to_dict(row):
+    """return dict of the job in row, with params, progress and result decoded.
+
+    The claim token is left out, it is only for the worker holding the claim.
+    """
+    job = dict(row)
+    del job["token"]
+    for name in ("params", "progress", "result"):
+        if job[name] is not None:
+            job[name] = json.loads(job[name])
+    return job
+
+
+class JobLost(Exception):
+    """the job was cancelled, or requeued and claimed by another worker."""
+
+
+class Heartbeat:
+    """thread beating for a claimed job every interval seconds, with its latest progress.
+
+    The runner sets progress as it goes; lost is set once the claim no longer
+    holds, see JobStore.heartbeat.
+    """
+
+    def __init__(self, store, job_id, token, interval=HEARTBEAT_SECONDS):
+        self.store = store
+        self.job_id = job_id
+        self.token = token
+        self.interval = interval
+        self.progress = None
+        self.lost = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="job-heartbeat", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """return None. Stop the thread, after a last beat with the final progress."""
+        self.stopping.set()
+        self.thread.join()
+        self.beat()
+
+    def beat(self):
+        """return None. Beat once, saving the latest progress."""
+        if not self.store.heartbeat(self.job_id, self.token, self.progress):
+            self.lost.set()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.beat()
+
+
+class JobManager:
+    """worker threads running the jobs of the JobStore under jobs_root.
+
+    Nothing touches the disk before start(), which creates the store.
+
+    arguments:
+    jobs_root - str or Path - directory of the job store and of the
+    checkpoints of every job
+    num_workers - int - number of jobs run at once
+    stale_seconds - float - see JobStore.requeue_stale
+    """
+
+    def __init__(self, jobs_root, num_workers=1, stale_seconds=STALE_SECONDS):
+        self.jobs_root = jobs_root
+        self.store = None
+        self.num_workers = num_workers
+        self.stale_seconds = stale_seconds
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.heartbeats = {} # of the jobs running here, by id
+        self.workers = []
+
+    def start(self):
+        """return self. Start the worker threads, unless they are running already."""
+        with self.lock:
+            if self.workers:
+                return self
+            os.makedirs(self.jobs_root, exist_ok=True)
+            self.store = JobStore(os.path.join(self.jobs_root, JOBS_DB))
+            self.workers = [threading.Thread(target=self.work, name="job-worker-{}".format(i),
+                                             daemon=True)
+                            for i in range(self.num_workers)]
+        for worker in self.workers:
+            worker.start()
+        return self
+
+    def stop(self, timeout=None):
+        """return None. Stop the workers; running jobs stop after their current chain.
+
+        Jobs stopped this way go back to the queue, to resume from their
+        checkpoints under the next JobManager.
+        """
+        self.stopping.set()
+        for worker in self.workers:
+            worker.join(timeout)
+
+    def submit(self, kind, params):
+        """return str, the id of the new job. Raises ValueError on a bad kind or params."""
+        if kind not in JOB_KINDS:
+            raise ValueError("unknown job kind {!r}, not one of {}".format(kind, JOB_KINDS))
+        params = check_sweep_params(params)
+        job_id = self.store.submit(kind, params)
+        emit("job_submitted", job_id=job_id, kind=kind)
+        return job_id
+
+    def cancel(self, job_id):
+        """return bool, see JobStore.cancel. A running job stops after its current chain."""
+        cancelled = self.store.cancel(job_id)
+        with self.lock:
+            heartbeat = self.heartbeats.get(job_id)
+        if heartbeat is not None:
+            heartbeat.lost.set()
+        return cancelled
+
+    def job_dir(self, job_id):
+        return os.path.join(self.jobs_root, job_id)
+
+    def work(self):
+        while not self.stopping.is_set():
+            self.store.requeue_stale(self.stale_seconds)
+            job = self.store.claim()
+            if job is None:
+                self.stopping.wait(POLL_SECONDS)
+                continue
+            self.run(job)
+
+    def run(self, job):
+        """return None. Run job to its end, recording the outcome in the store."""
+        job_id, token = job["id"], job["token"]
+        heartbeat = Heartbeat(self.store, job_id, token).start()
+        with self.lock:
+            self.heartbeats[job_id] = heartbeat
+        emit("job_started", job_id=job_id, kind=job["kind"])
+        try:
+            result = self.run_sweep(job_id, job["params"], heartbeat)
+        except JobLost:
+            emit("job_lost", job_id=job_id)
+            return
+        except Exception as error:
+            self.store.finish(job_id, token, "failed", error=repr(error))
+            emit("job_failed", job_id=job_id, error=repr(error))
+            return
+        finally:
+            heartbeat.stop()
+            with self.lock:
+                del self.heartbeats[job_id]
+        if result is None: # stopping
+            self.store.finish(job_id, token, "queued")
+        elif self.store.finish(job_id, token, "done", result=result):
+            emit("job_done", job_id=job_id)
+
+    def run_sweep(self, job_id, params, heartbeat):
+        """return list of the statistics of every cell, or None if stopped before the end.
+
+        Raises JobLost as soon as heartbeat finds the claim on the job gone.
+        """
+        conditions = params["conditions"]
+        cells = []
+        heartbeat.progress = {"cells_done": 0, "num_cells": len(conditions), "current": None}
+        for num_nodes, num_chains in conditions:
+            checkpoint_dir = os.path.join(self.job_dir(job_id), "N{}".format(num_nodes))
+            stats = None
+            stream = stream_monte_carlo(num_nodes, num_chains, seed=params["seed"],
+                                        num_workers=params["num_workers"],
+                                        checkpoint_dir=checkpoint_dir)
+            try:
+                for _, stats in stream:
+                    if heartbeat.lost.is_set():
+                        raise JobLost(job_id)
+                    if self.stopping.is_set():
+                        return None
+                    heartbeat.progress = dict(heartbeat.progress,
+                                              current=cell_summary(num_nodes, stats))
+            finally:
+                stream.close()
+            if stats is None: # finished before a restart
+                stats = RunningStats(**load_checkpoint(checkpoint_dir)["stats"])
+            cells.append(cell_summary(num_nodes, stats))
+            heartbeat.progress = dict(heartbeat.progress, cells_done=len(cells), current=None)
+            emit("job_progress", job_id=job_id, **cells[-1])
+        return cells
+
+
+def cell_summary(num_nodes, stats):
+    """return dict of the statistics of one (N, number of chains) cell of a sweep."""
+    return {"num_nodes": int(num_nodes), "num_chains": stats.count,
+            "knot_probability": stats.knot_probability,
+            "attempt_mean": stats.attempt_mean, "attempt_std": stats.attempt_std}
+
+
+def check_sweep_params(params):
+    """return params of a sweep with defaults filled in. Raises ValueError if they are bad.
+
+    arguments:
+    params - dict - 'conditions', a list of [N, number of chains], defaulting
+    to SIMULATION_CONDITIONS; 'seed', an int or None; 'num_workers', the
+    worker processes of every cell, at most the number of cpus. N and the
+    counts are bounded as for /chains, by MAX_NODES and MAX_CHAINS_PER_REQUEST
+    """
+    unknown = set(params) - {"conditions", "seed", "num_workers"}
+    if unknown:
+        raise ValueError("unknown sweep parameters {}".format(sorted(unknown)))
+    conditions = params.get("conditions", SIMULATION_CONDITIONS.tolist())
+    try:
+        conditions = [[int(num_nodes), int(num_chains)] for num_nodes, num_chains in conditions]
+    except (TypeError, ValueError):
+        raise ValueError("conditions must be a list of [N, number of chains]")
+    if not conditions:
+        raise ValueError("conditions must not be empty")
+    if any(num_nodes % 2 or not 4 <= num_nodes <= MAX_NODES for num_nodes, _ in conditions):
+        raise ValueError("every N must be even, between 4 and {}".format(MAX_NODES))
+    if any(not 1 <= num_chains <= MAX_CHAINS_PER_REQUEST for _, num_chains in conditions):
+        raise ValueError("every count must be between 1 and {}".format(MAX_CHAINS_PER_REQUEST))
+    if len({num_nodes for num_nodes, _ in conditions}) != len(conditions):
+        raise ValueError("every N must appear once in the conditions")
+    seed = params.get("seed")
+    if seed is not None and (not isinstance(seed, int) or seed < 0):
+        raise ValueError("seed must be a non-negative int")
+    num_workers = params.get("num_workers", 1)
+    max_workers = os.cpu_count() or 1
+    if not isinstance(num_workers, int) or not 1 <= num_workers <= max_workers:
+        raise ValueError("num_workers must be an int between 1 and {}".format(max_workers))
+    return {"conditions": conditions, "seed": seed, "num_workers": num_workers}
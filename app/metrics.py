@@ -0,0 +1,131 @@
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Lightweight instrumentation for the chain -> knot pipeline.
+#
+# Functions decorated with instrument(stage) record their call count and wall
+# time under stage, plus any counts (crossings, closure attempts...) their
+# result yields, while metrics are enabled. Disabled, which is the default,
+# the decorator costs one attribute lookup per call. Set METRICS_ENABLED=1 in
+# the environment, or call metrics.enable(), to turn them on.
+#
+# Events, such as progress reports, go through emit() to every sink of the
+# registry, whether or not timings are enabled. A sink is any callable taking
+# the event as a dict; by default events are written as json lines to stderr,
+# so long runs report their progress out of the box, as their prints used to.
+# Replace metrics.sinks to send them elsewhere, e.g. to logging_sink, which
+# logs them to the "app.metrics" logger instead.
+#
+# Every process has its own registry, so worker processes of a monte carlo
+# run record into theirs, not into the parent's.
+LOGGER = logging.getLogger("app.metrics")
+
+
+def stderr_sink(event):
+    """return None. Write event as one json line to stderr."""
+    print(json.dumps(event, default=str), file=sys.stderr, flush=True)
+
+
+def logging_sink(event):
+    """return None. Log event as one json line at INFO level."""
+    LOGGER.info(json.dumps(event, default=str))
+
+
+class JSONLinesSink:
+    """sink appending every event as a json line to the file at path."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        with self.lock, open(self.path, "a") as ofile:
+            ofile.write(json.dumps(event, default=str) + "\n")
+
+
+class Metrics:
+    """registry of stage timings and counts, and the sinks events go to."""
+
+    def __init__(self, enabled=False, sinks=(stderr_sink,)):
+        self.enabled = enabled
+        self.sinks = list(sinks)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        """return None. Forget every timing and count recorded so far."""
+        with self.lock:
+            self.calls = Counter()
+            self.seconds = Counter()
+            self.max_seconds = {}
+            self.counts = Counter()
+
+    def record_call(self, stage, seconds):
+        with self.lock:
+            self.calls[stage] += 1
+            self.seconds[stage] += seconds
+            self.max_seconds[stage] = max(self.max_seconds.get(stage, 0.0), seconds)
+
+    def count(self, name, value=1):
+        """return None. Add value to the count name, if metrics are enabled."""
+        if self.enabled:
+            with self.lock:
+                self.counts[name] += value
+
+    def emit(self, event, **fields):
+        """return None. Hand the event, with its fields and a timestamp, to every sink."""
+        record = dict(event=event, time=time.time(), **fields)
+        for sink in self.sinks:
+            sink(record)
+
+    def snapshot(self):
+        """return dict of everything recorded so far, ready to dump as json."""
+        with self.lock:
+            return {"enabled": self.enabled,
+                    "stages": {stage: {"calls": self.calls[stage],
+                                       "total_seconds": self.seconds[stage],
+                                       "mean_seconds": self.seconds[stage] / self.calls[stage],
+                                       "max_seconds": self.max_seconds[stage]}
+                               for stage in self.calls},
+                    "counts": dict(self.counts)}
+
+
+metrics = Metrics(enabled=os.environ.get("METRICS_ENABLED", "") not in ("", "0"))
+
+
+def instrument(stage, counts=None):
+    """return decorator recording calls and timings of the decorated function under stage.
+
+    arguments:
+    stage - str - the name to record under
+    counts - callable - if given, maps the result of the function to a dict of
+    counts to add, such as {'crossings': I}; only called while enabled
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            metrics.record_call(stage, time.perf_counter() - start)
+            if counts is not None:
+                for name, value in counts(result).items():
+                    metrics.count(name, value)
+            return result
+        return wrapper
+    return decorator
+
+
+def emit(event, **fields):
+    """return None. Emit event to the sinks of the global registry, see Metrics.emit."""
+    metrics.emit(event, **fields)
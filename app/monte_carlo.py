@@ -1,19 +1,68 @@
 import os
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 import matplotlib.pyplot as plt
 import numpy as np
 
-from .alexander import evaluate_alexander_polynomial, populate_alexander_matrix
-from .generate_chain import generate_closed_chain
+from .alexander import classify_chain, format_classifier_stats
+from .generate_chain import chain_rng, generate_closed_chain
+from .metrics import emit
+from .pipeline import RunningStats, load_checkpoint, run_chains, stream_monte_carlo
 from .private.utilities import rot_saw_xy
 from .projection import find_reg_project
 
 
-def basic_monte_carlo_sim(num_nodes, num_chains, table=True, shift=False):
+# the classification cache of a worker process of basic_monte_carlo_sim
+worker_cache = None
+
+
+def set_worker_cache(cache):
+    """return None. Install cache as the classification cache of this worker process."""
+    global worker_cache
+    worker_cache = cache
+
+
+def simulate_chain(num_nodes, shift=False, seed_sequence=None, reduce=False, cache=None):
+    """return (alex_poly, num_attempts, stats) for a single freshly generated chain.
+
+    The chain is drawn from its own stream when seed_sequence is given, and
+    from the global numpy stream otherwise. It is classified by
+    classify_chain, reducing it first if reduce is set, and stats is the
+    Counter classify_chain filled in. With a ClassificationCache (given, or
+    installed by set_worker_cache) repeat chains skip classification. Kept at
+    module level so that it can be shipped to the worker processes of
+    basic_monte_carlo_sim."""
+    rng = None if seed_sequence is None else chain_rng(seed_sequence)
+    chain_and_attempts = generate_closed_chain(num_nodes, shift, rng=rng)
+    chain = chain_and_attempts['chain']
+    num_attempts = chain_and_attempts['attempts']
+    stats = Counter()
+    cache = worker_cache if cache is None else cache
+    if cache is None:
+        alex_poly, _ = classify_chain(chain, stats, reduce=reduce)
+    else:
+        alex_poly, _ = cache.classify(chain, stats, reduce=reduce)
+    return alex_poly, num_attempts, stats
+
+
+def basic_monte_carlo_sim(num_nodes, num_chains, table=True, shift=False,
+                          num_workers=1, seed=None, reduce=False, cache=None):
     """return raw_data. Print table and final statistics for monte carlo sim.
     
     We are concerned with the distributions of knot formation as well as
-    number of attempts."""
+    number of attempts.
+
+    When a master seed is given (or num_workers > 1), every chain gets its own
+    random stream spawned from the master seed, so raw_data only depends on
+    the seed and not on the number of worker processes the chains are spread
+    over. Otherwise the chains are drawn one after another from the global
+    numpy stream, as before. With reduce, every chain goes through
+    reduce_polygon before it is classified. With a ClassificationCache,
+    chains classified before are looked up instead; worker processes each
+    get an empty memory tier over the same disk tier."""
     raw_data = np.zeros((num_chains,2)) # first element is result of is_knotted, second is num attempts
     if table:
         print("+-----------------+---  MONTE CARLO SIMULATION ---+----------------+")
@@ -21,20 +70,41 @@ def basic_monte_carlo_sim(num_nodes, num_chains, table=True, shift=False):
         print("+-----------------+-------------------------------+----------------+")
     
     # run the simulation
-    for i in np.arange(num_chains):
-        chain, num_attempts = generate_closed_chain(num_nodes, shift)
-        #print(chain)
-        alex_mat = populate_alexander_matrix(chain[:-1], -1)
-        alex_poly = evaluate_alexander_polynomial(alex_mat)
-        is_knotted = not (alex_poly == 1)
-        if i % 100 == 0:
-            print("chain {}".format(i))
-        if table:
-            print("|{:^17}|{:^31}|{:^16}|".format(i+1, alex_poly, is_knotted))
-            print("+-----------------+-------------------------------+----------------+")
-
-        raw_data[i][0] = is_knotted
-        raw_data[i][1] = num_attempts
+    stage_counts = Counter()
+    if seed is None and num_workers == 1:
+        results = (simulate_chain(num_nodes, shift, reduce=reduce, cache=cache)
+                   for i in np.arange(num_chains))
+        executor = None
+    else:
+        seed_sequences = np.random.SeedSequence(seed).spawn(num_chains)
+        if num_workers == 1:
+            results = (simulate_chain(num_nodes, shift, ss, reduce, cache) for ss in seed_sequences)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=num_workers,
+                                           initializer=set_worker_cache,
+                                           initargs=(cache,))
+            chunksize = max(1, num_chains // (4 * num_workers))
+            results = executor.map(simulate_chain, [num_nodes] * num_chains,
+                                   [shift] * num_chains, seed_sequences,
+                                   [reduce] * num_chains, chunksize=chunksize)
+
+    try:
+        for i, (alex_poly, num_attempts, chain_stats) in enumerate(results):
+            stage_counts.update(chain_stats)
+            is_knotted = not (alex_poly == 1)
+            if i % 100 == 0:
+                emit("monte_carlo_progress", num_nodes=num_nodes, chains_done=i,
+                     num_chains=num_chains)
+            if table:
+                print("|{:^17}|{:^31}|{:^16}|".format(i+1, alex_poly, is_knotted))
+                print("+-----------------+-------------------------------+----------------+")
+
+            raw_data[i][0] = is_knotted
+            raw_data[i][1] = num_attempts
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
     # analyze the results
     total_knots = len(np.where(raw_data[:,0])[0])
@@ -42,24 +112,139 @@ def basic_monte_carlo_sim(num_nodes, num_chains, table=True, shift=False):
     print("Total knots: {}".format(total_knots))
     print("Mean of number of attempts was {}".format(attempt_stats[0]))
     print("Std dev of number of attempts was {}".format(attempt_stats[1]))
+    print("Chains settled by classifier stage: {}".format(format_classifier_stats(stage_counts)))
+    emit("monte_carlo_done", num_nodes=num_nodes, num_chains=num_chains, total_knots=total_knots,
+         attempt_mean=attempt_stats[0], attempt_std=attempt_stats[1], stages=dict(stage_counts))
 
     return raw_data
 
 
-def cum_monte_carlo_sim():
-    """return None. run many monte Carlo simulations with various conditions.
+# (N, number of chains) of every run of cum_monte_carlo_sim
+SIMULATION_CONDITIONS = np.array([[20, 12560], [30, 5950], [40, 3000], [50, 2500],
+    [60, 3450], [70, 1460], [80, 1340], [90, 1120], [100, 910], [110, 400],
+    [120, 415], [130, 520], [140, 420]])
+
+
+def cum_monte_carlo_sim(checkpoint_root="cum_monte_carlo", num_workers=1, seed=None,
+                        half_width=None, confidence=0.95, time_budget=None):
+    """return probs_of_knot_formation. run many monte Carlo simulations with various conditions.
     
     This will take a while (11/07/2021)
-    
+
+    Every condition runs through stream_monte_carlo with its own checkpoint
+    directory under checkpoint_root, so an interrupted sweep picks up where it
+    stopped when called again, and partial statistics are emitted to the
+    metrics sinks as they come in.
+
+    With half_width, the chain counts of the conditions only serve as caps:
+    adaptive_monte_carlo_sim samples every N until its knot probability is
+    known to within half_width, see there.
     """
 
-    simulation_conditions = np.array([[20, 12560], [30, 5950], [40, 3000], [50, 2500], 
-        [60, 3450], [70, 1460], [80, 1340], [90, 1120], [100, 910], [110, 400]
-        [120, 415], [130, 520], [140, 420]])
+    simulation_conditions = SIMULATION_CONDITIONS
+
+    if half_width is not None:
+        results = adaptive_monte_carlo_sim(simulation_conditions[:,0], half_width, confidence,
+                                           max_chains=simulation_conditions[:,1],
+                                           time_budget=time_budget,
+                                           checkpoint_root=checkpoint_root,
+                                           num_workers=num_workers, seed=seed)
+        return results['knot_probability']
     
     probs_of_knot_formation = np.zeros(np.shape(simulation_conditions)[0])
-    for condition in simulation_conditions:
-        this_run_data = basic_monte_carlo_sim(condition[0], condition[1], table=False)
-        # TODO: for now, save png's of num attempts statistics in image folder,
-        #       calculate mean and std dev of that dist, and prob of knot formation
-    return None
+    for i, (num_nodes, num_chains) in enumerate(simulation_conditions):
+        checkpoint_dir = None if checkpoint_root is None else \
+            os.path.join(checkpoint_root, "N{}".format(num_nodes))
+        stats = None
+        for (index, _, _, _), stats in stream_monte_carlo(num_nodes, num_chains, seed=seed,
+                                                          num_workers=num_workers,
+                                                          checkpoint_dir=checkpoint_dir):
+            if (index + 1) % 100 == 0:
+                emit("sweep_progress", num_nodes=int(num_nodes), chains_done=stats.count,
+                     knot_probability=stats.knot_probability,
+                     attempt_mean=stats.attempt_mean, attempt_std=stats.attempt_std)
+        if stats is None: # resumed a finished run
+            stats = RunningStats(**load_checkpoint(checkpoint_dir)["stats"])
+        probs_of_knot_formation[i] = stats.knot_probability
+        emit("sweep_done", num_nodes=int(num_nodes), chains_done=stats.count,
+             knot_probability=stats.knot_probability,
+             attempt_mean=stats.attempt_mean, attempt_std=stats.attempt_std)
+        # TODO: for now, save png's of num attempts statistics in image folder
+    return probs_of_knot_formation
+
+
+# one row of the results of adaptive_monte_carlo_sim
+ADAPTIVE_RESULT_DTYPE = [('num_nodes', np.int64), ('num_chains', np.int64),
+                         ('knot_probability', np.float64), ('low', np.float64),
+                         ('high', np.float64), ('half_width', np.float64),
+                         ('converged', np.bool_)]
+
+
+def adaptive_monte_carlo_sim(node_counts, half_width=0.01, confidence=0.95, max_chains=None,
+                             time_budget=None, batch_size=200, checkpoint_root=None,
+                             num_workers=1, seed=None):
+    """return results, the knot probability of every N with its achieved error bars.
+
+    Sequential sampling: chains are drawn batch_size at a time, each batch
+    going to the N whose Wilson interval (see RunningStats) is currently the
+    widest, until every N has reached half_width at the given confidence or
+    has used up its max_chains, or time_budget seconds have passed. So easy N
+    stop early and the chains go where the variance is.
+
+    Every N keeps a checkpoint directory under checkpoint_root (a temporary
+    one if None), so calling this again with a tighter half_width or a bigger
+    budget carries on from the chains already analysed.
+
+    arguments:
+    node_counts - iterable of ints - the values of N to estimate
+    half_width - float - target half-width of the confidence intervals
+    confidence - float - confidence level of the intervals
+    max_chains - int or iterable of ints, one per N - cap on the chains of each
+    N, unlimited if None
+    time_budget - float - seconds after which no new batch is started
+    batch_size - int - chains per scheduling step
+    checkpoint_root, num_workers, seed - as in cum_monte_carlo_sim
+
+    return value:
+    results - numpy structured array with dtype ADAPTIVE_RESULT_DTYPE, one row
+    per N
+    """
+    node_counts = [int(n) for n in node_counts]
+    caps = np.broadcast_to(np.inf if max_chains is None else max_chains, len(node_counts))
+    start_time = time.monotonic()
+
+    temporary = tempfile.TemporaryDirectory() if checkpoint_root is None else None
+    root = checkpoint_root if temporary is None else temporary.name
+    # one pool for the whole run, rather than one per batch
+    executor = ProcessPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+    try:
+        checkpoint_dirs = [os.path.join(root, "N{}".format(n)) for n in node_counts]
+        # pick up whatever earlier calls left behind
+        stats = [run_chains(n, 0, d, seed=seed) for n, d in zip(node_counts, checkpoint_dirs)]
+
+        while time_budget is None or time.monotonic() - start_time < time_budget:
+            widths = np.array([s.half_width(confidence) for s in stats])
+            open_ = (widths > half_width) & (np.array([s.count for s in stats]) < caps)
+            if not np.any(open_):
+                break
+            i = np.argmax(np.where(open_, widths, -1))
+            num_chains = int(min(stats[i].count + batch_size, caps[i]))
+            stats[i] = run_chains(node_counts[i], num_chains, checkpoint_dirs[i],
+                                  seed=seed, num_workers=num_workers, executor=executor)
+            emit("adaptive_progress", num_nodes=node_counts[i], chains_done=stats[i].count,
+                 knot_probability=stats[i].knot_probability,
+                 half_width=stats[i].half_width(confidence))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if temporary is not None:
+            temporary.cleanup()
+
+    results = np.zeros(len(node_counts), dtype=ADAPTIVE_RESULT_DTYPE)
+    for row, n, s in zip(results, node_counts, stats):
+        low, high = s.knot_probability_interval(confidence)
+        row['num_nodes'], row['num_chains'] = n, s.count
+        row['knot_probability'], row['low'], row['high'] = s.knot_probability, low, high
+        row['half_width'] = s.half_width(confidence)
+        row['converged'] = row['half_width'] <= half_width
+    return results
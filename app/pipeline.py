@@ -0,0 +1,358 @@
+import json
+import os
+from collections import Counter, deque
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .alexander import CLASSIFIER_STAGES, classify_crossings
+from .generate_chain import chain_rng, generate_closed_chain
+from .private.utilities import build_crossing_table, rot_saw_xy
+from .projection import find_reg_project
+
+# A monte carlo run as a chain of generators, each stage pulling records from
+# the one before it and handing them on as soon as they are done:
+#
+#   chain_source -> projection_stage -> crossing_stage -> invariant_stage
+#
+# A record is a dict that every stage adds its output to. Nothing is pulled
+# from a stage before the next one asks for it, so a slow consumer holds the
+# whole pipeline back rather than piling up chains in memory. Worker
+# processes get the same back-pressure through bounded_map.
+#
+# stream_monte_carlo drives the stages, aggregates the results as they come
+# and, given a checkpoint directory, keeps there
+#
+#   state.json  - the run parameters, the next chain to analyse and the
+#                 aggregate statistics, replaced atomically
+#   results.tsv - one line "index alex_poly attempts stage" per chain
+#
+# Chain i is always drawn from the i-th child of the run's seed sequence, so
+# a resumed run carries on exactly where the interrupted one stopped.
+STATE_FILE = "state.json"
+RESULTS_FILE = "results.tsv"
+# parameters a checkpoint must agree on to be resumed
+RUN_PARAMETERS = ("num_nodes", "shift", "method")
+# limits on the chains a single web request, or cell of a job, may ask for;
+# MAX_NODES is the longest chain the classifier is tested on (see
+# classify_chain_long_unit_test), raise both together
+MAX_NODES = 400
+MAX_CHAINS_PER_REQUEST = 100000
+
+
+def chain_source(num_nodes, indices, shift=False, entropy=None):
+    """yield a record {'index', 'chain', 'attempts'} for every chain index in indices.
+
+    Chain i is drawn from its own stream, spawned as child i of the seed
+    sequence with the given entropy, the same stream basic_monte_carlo_sim
+    gives chain i for seed=entropy.
+    """
+    for index in indices:
+        seed_sequence = np.random.SeedSequence(entropy, spawn_key=(index,))
+        chain_and_attempts = generate_closed_chain(num_nodes, shift, rng=chain_rng(seed_sequence))
+        yield {"index": index, "chain": chain_and_attempts['chain'],
+               "attempts": int(chain_and_attempts['attempts'])}
+
+
+def upload_source(chains):
+    """yield a record {'index', 'chain', 'attempts'} for every chain of chains, as given.
+
+    For chains that were not generated here, such as ones uploaded to the web
+    app, so their attempts are None.
+    """
+    for index, chain in enumerate(chains):
+        yield {"index": index, "chain": np.asarray(chain, dtype=np.float64), "attempts": None}
+
+
+def projection_stage(records):
+    """yield records with the rotated chain 'rot_saw' and its projection 'proj' added."""
+    for record in records:
+        saw = record["chain"]
+        record["rot_saw"] = rot_saw_xy(saw)
+        record["proj"] = find_reg_project(saw)
+        yield record
+
+
+def crossing_stage(records, method="brute"):
+    """yield records with their 'crossing_table' added, see build_crossing_table."""
+    for record in records:
+        record["crossing_table"] = build_crossing_table(record["proj"], record["rot_saw"], method)
+        yield record
+
+
+def invariant_stage(records):
+    """yield records with 'alex_poly' and the classifier 'stage' added, see classify_crossings."""
+    for record in records:
+        record["alex_poly"], record["stage"] = classify_crossings(
+            record["rot_saw"], record["proj"], record["crossing_table"])
+        yield record
+
+
+def summary_stage(records):
+    """yield a dict of the index, alex_poly, crossings, attempts and stage of every record.
+
+    The end of the pipeline for clients: the bulky intermediate fields are
+    dropped, and crossings counts the underpasses of the crossing table.
+    """
+    for record in records:
+        yield {"index": record["index"], "alex_poly": int(record["alex_poly"]),
+               "crossings": int(np.count_nonzero(record["crossing_table"]["is_underpass"])),
+               "attempts": record["attempts"], "stage": record["stage"]}
+
+
+# fixed size little-endian record of summary_stage output, for binary
+# responses; stage is the index into CLASSIFIER_STAGES, attempts 0 if unknown
+SUMMARY_DTYPE = np.dtype([('index', '<u4'), ('alex_poly', '<i8'), ('crossings', '<u4'),
+                          ('attempts', '<u4'), ('stage', 'u1')])
+
+
+def summaries_to_bytes(summaries):
+    """return bytes of the SUMMARY_DTYPE records of a list of summary_stage dicts."""
+    records = np.zeros(len(summaries), dtype=SUMMARY_DTYPE)
+    for record, summary in zip(records, summaries):
+        record['index'], record['alex_poly'] = summary["index"], summary["alex_poly"]
+        record['crossings'], record['attempts'] = summary["crossings"], summary["attempts"] or 0
+        record['stage'] = CLASSIFIER_STAGES.index(summary["stage"])
+    return records.tobytes()
+
+
+def analyse_chains(num_nodes, indices, shift=False, entropy=None, method="brute"):
+    """yield (index, alex_poly, attempts, stage) for every chain index in indices.
+
+    The whole pipeline for a run of chains, dropping the bulky intermediate
+    fields. Kept at module level so that worker processes can run it.
+    """
+    records = chain_source(num_nodes, indices, shift, entropy)
+    for record in invariant_stage(crossing_stage(projection_stage(records), method)):
+        yield record["index"], int(record["alex_poly"]), record["attempts"], record["stage"]
+
+
+def analyse_chain(num_nodes, index, shift=False, entropy=None, method="brute"):
+    """return (index, alex_poly, attempts, stage) for the single chain index."""
+    return next(analyse_chains(num_nodes, [index], shift, entropy, method))
+
+
+def bounded_map(executor, func, *iterables, max_in_flight):
+    """yield func(*args) for the args of iterables, in order, computed by executor.
+
+    Unlike executor.map, which submits everything up front, at most
+    max_in_flight calls are pending at any time, so the iterables are only
+    consumed as fast as the results are. Calls still pending when the
+    generator is closed are cancelled, so a shared executor is left idle.
+    """
+    pending = deque()
+    try:
+        for args in zip(*iterables):
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, *args))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class RunningStats:
+    """knot probability and attempt mean/std of a run, updated one chain at a time.
+
+    The attempt moments use Welford's update, so they never need the earlier
+    results, and std is the population std, as np.std.
+    """
+
+    def __init__(self, count=0, knots=0, attempt_mean=0.0, attempt_m2=0.0, stages=None):
+        self.count = count
+        self.knots = knots
+        self.attempt_mean = attempt_mean
+        self.attempt_m2 = attempt_m2
+        self.stages = Counter(stages or {})
+
+    def update(self, alex_poly, attempts, stage=None):
+        """return None. Add the result of one chain."""
+        self.count += 1
+        self.knots += alex_poly != 1
+        delta = attempts - self.attempt_mean
+        self.attempt_mean += delta / self.count
+        self.attempt_m2 += delta * (attempts - self.attempt_mean)
+        if stage is not None:
+            self.stages[stage] += 1
+
+    @property
+    def knot_probability(self):
+        return self.knots / self.count if self.count else 0.0
+
+    @property
+    def attempt_std(self):
+        return np.sqrt(self.attempt_m2 / self.count) if self.count else 0.0
+
+    def knot_probability_interval(self, confidence=0.95):
+        """return (low, high), the Wilson score interval of the knot probability.
+
+        Unlike the normal approximation, the Wilson interval does not shrink
+        to nothing when no knot has been seen yet, which for short chains is
+        the usual case.
+        """
+        if not self.count:
+            return 0.0, 1.0
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        p, n = self.knot_probability, self.count
+        centre = (p + z*z / (2*n)) / (1 + z*z / n)
+        spread = z * np.sqrt(p * (1 - p) / n + z*z / (4*n*n)) / (1 + z*z / n)
+        return max(0.0, centre - spread), min(1.0, centre + spread)
+
+    def half_width(self, confidence=0.95):
+        """return the half-width of knot_probability_interval."""
+        low, high = self.knot_probability_interval(confidence)
+        return (high - low) / 2
+
+    def to_dict(self):
+        return {"count": self.count, "knots": self.knots, "attempt_mean": self.attempt_mean,
+                "attempt_m2": self.attempt_m2, "stages": dict(self.stages)}
+
+    def __repr__(self):
+        return "RunningStats(count={}, knot_probability={:.4f}, attempt_mean={:.4f}, " \
+               "attempt_std={:.4f})".format(self.count, self.knot_probability,
+                                            self.attempt_mean, self.attempt_std)
+
+
+def load_checkpoint(checkpoint_dir):
+    """return the state saved in checkpoint_dir, or None if there is none."""
+    state_path = os.path.join(checkpoint_dir, STATE_FILE)
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path) as state_file:
+        return json.load(state_file)
+
+
+def save_checkpoint(checkpoint_dir, state):
+    """return None. Replace the state saved in checkpoint_dir, atomically."""
+    state_path = os.path.join(checkpoint_dir, STATE_FILE)
+    with open(state_path + ".tmp", "w") as state_file:
+        json.dump(state, state_file)
+        state_file.flush()
+        os.fsync(state_file.fileno())
+    os.replace(state_path + ".tmp", state_path)
+
+
+def truncate_results(results_path, num_lines):
+    """return None. Drop every line of results_path after the first num_lines."""
+    if not os.path.exists(results_path):
+        open(results_path, "w").close()
+        return
+    with open(results_path, "rb+") as results_file:
+        for _ in range(num_lines):
+            results_file.readline()
+        results_file.truncate(results_file.tell())
+
+
+def stream_monte_carlo(num_nodes, num_chains, shift=False, seed=None, method="brute",
+                       num_workers=1, checkpoint_dir=None, checkpoint_every=100,
+                       max_in_flight=None, executor=None):
+    """yield (result, stats) as each chain of a monte carlo run is analysed.
+
+    result is (index, alex_poly, attempts, stage) and stats the RunningStats
+    of the run so far, the same object every time. Results come in chain
+    order, also with num_workers > 1.
+
+    With a checkpoint_dir, the run is saved there every checkpoint_every
+    chains and whenever it stops, even by an exception or KeyboardInterrupt,
+    and a run started on a directory holding a checkpoint resumes it: chains
+    already analysed are skipped and the statistics carry on from where they
+    were. Results of a resumed run are identical to those of an unbroken one.
+
+    arguments:
+    num_nodes - int - number of nodes of every chain
+    num_chains - int - number of chains of the whole run, resumed or not
+    shift, method - as in generate_closed_chain and classify_chain
+    seed - int or None - the master seed, ignored when resuming
+    num_workers - int - number of worker processes
+    checkpoint_dir - str or Path or None - where to keep the checkpoint
+    checkpoint_every - int - chains between checkpoints
+    max_in_flight - int - the most chains being analysed at once by workers,
+    4 per worker by default
+    executor - concurrent.futures.Executor or None - num_workers workers to
+    analyse the chains on, shared by several runs and left running at the end;
+    if None, a process pool is started for this run alone
+    """
+    parameters = {"num_nodes": int(num_nodes), "shift": bool(shift), "method": method}
+    state = None if checkpoint_dir is None else load_checkpoint(checkpoint_dir)
+    if state is None:
+        state = dict(parameters, entropy=np.random.SeedSequence(seed).entropy,
+                     next_index=0, stats=RunningStats().to_dict())
+    elif any(state[name] != parameters[name] for name in RUN_PARAMETERS):
+        raise ValueError("checkpoint in {} is of a run with {}, not {}".format(
+                         checkpoint_dir, {name: state[name] for name in RUN_PARAMETERS},
+                         parameters))
+    stats = RunningStats(**state["stats"])
+    indices = range(state["next_index"], num_chains)
+
+    results_file = None
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        results_path = os.path.join(checkpoint_dir, RESULTS_FILE)
+        truncate_results(results_path, state["next_index"])
+        results_file = open(results_path, "a")
+
+    def checkpoint():
+        if results_file is not None:
+            results_file.flush()
+            os.fsync(results_file.fileno())
+            save_checkpoint(checkpoint_dir, dict(state, stats=stats.to_dict()))
+
+    own_executor = None
+    if executor is None and num_workers > 1:
+        executor = own_executor = ProcessPoolExecutor(max_workers=num_workers)
+    if executor is None:
+        results = analyse_chains(num_nodes, indices, shift, state["entropy"], method)
+    else:
+        results = bounded_map(executor, analyse_chain, [num_nodes] * len(indices), indices,
+                              [shift] * len(indices), [state["entropy"]] * len(indices),
+                              [method] * len(indices),
+                              max_in_flight=max_in_flight or 4 * num_workers)
+    try:
+        for result in results:
+            index, alex_poly, attempts, stage = result
+            stats.update(alex_poly, attempts, stage)
+            state["next_index"] = index + 1
+            if results_file is not None:
+                results_file.write("{}\t{}\t{}\t{}\n".format(*result))
+                if state["next_index"] % checkpoint_every == 0:
+                    checkpoint()
+            yield result, stats
+    finally:
+        checkpoint()
+        if results_file is not None:
+            results_file.close()
+        if own_executor is not None:
+            own_executor.shutdown(cancel_futures=True)
+        elif executor is not None:
+            results.close() # cancels the chains still pending on the shared executor
+
+
+def read_results(checkpoint_dir):
+    """return raw_data from the results saved in checkpoint_dir, as basic_monte_carlo_sim."""
+    state = load_checkpoint(checkpoint_dir)
+    num_results = 0 if state is None else state["next_index"]
+    raw_data = np.zeros((num_results, 2))
+    with open(os.path.join(checkpoint_dir, RESULTS_FILE)) as results_file:
+        for i, line in zip(range(num_results), results_file):
+            _, alex_poly, attempts, _ = line.split("\t")
+            raw_data[i] = int(alex_poly) != 1, int(attempts)
+    return raw_data
+
+
+def run_chains(num_nodes, num_chains, checkpoint_dir, **kwargs):
+    """return the RunningStats of the first num_chains chains of the run in checkpoint_dir.
+
+    Runs stream_monte_carlo to the end, analysing only the chains the
+    checkpoint does not hold yet, so calling this with growing num_chains
+    extends a run step by step. kwargs are passed on to stream_monte_carlo.
+    """
+    stats = None
+    for _, stats in stream_monte_carlo(num_nodes, num_chains, checkpoint_dir=checkpoint_dir, **kwargs):
+        pass
+    if stats is None: # nothing left to analyse
+        state = load_checkpoint(checkpoint_dir)
+        stats = RunningStats() if state is None else RunningStats(**state["stats"])
+    return stats
@@ -0,0 +1,222 @@
+import numpy as np
+
+# Exact linear algebra over the integers modulo a prime p, on int64 arrays.
+#
+# All primes are below 2**25, so a product of two residues stays below 2**50
+# and up to 2**13 of them can be summed without overflowing an int64. Longer
+# sums are split into blocks of DOT_BLOCK terms (see mod_dot).
+DOT_BLOCK = 1 << 12
+
+
+def largest_primes_below(bound, count):
+   """return list of the count largest primes below bound, in decreasing order."""
+   sieve_limit = int(np.sqrt(bound)) + 1
+   small = np.ones(sieve_limit, dtype=bool)
+   small[:2] = False
+   for i in range(2, int(np.sqrt(sieve_limit)) + 1):
+      if small[i]:
+         small[i*i::i] = False
+   small_primes = np.nonzero(small)[0]
+
+   # segmented sieve over windows just below bound
+   primes = []
+   window = 1 << 14
+   while len(primes) < count:
+      start = bound - window
+      is_prime = np.ones(window, dtype=bool)
+      for q in small_primes.tolist():
+         is_prime[(-start) % q::q] = False
+      primes.extend((start + np.nonzero(is_prime)[0])[::-1].tolist())
+      bound = start
+   return primes[:count]
+
+
+# enough for coefficients of about 2500 bits
+PRIMES = largest_primes_below(1 << 25, 100)
+
+
+def mod_dot(a, b, p):
+   """return a @ b modulo p, for int64 arrays of residues modulo p."""
+   inner = np.shape(a)[-1]
+   result = np.zeros(np.shape(a)[:-1] + np.shape(b)[1:], dtype=np.int64)
+   for start in range(0, inner, DOT_BLOCK):
+      result = (result + (a[..., start:start+DOT_BLOCK] @ b[start:start+DOT_BLOCK]) % p) % p
+   return result
+
+
+def mod_solve(B, A, p):
+   """return (det(B), B^-1 @ A) modulo p, or (0, None) if B is singular modulo p.
+
+   Gauss-Jordan elimination on the augmented matrix [B | A]. Only the rows
+   with a nonzero entry in the pivot column are updated, so sparse matrices
+   such as the alexander matrix are cheap to eliminate while fill-in is low.
+
+   arguments:
+   B - numpy array of int64 with shape (n, n) - residues modulo p
+   A - numpy array of int64 with shape (n, m) - residues modulo p
+   p - int - the prime modulus
+
+   return value:
+   det - int - the determinant of B modulo p
+   X - numpy array of int64 with shape (n, m) - the solution of B @ X = A
+   """
+   n = B.shape[0]
+   aug = np.concatenate((B, A), axis=1) % p
+   det = 1
+   for col in range(n):
+      candidates = np.nonzero(aug[col:, col])[0]
+      if candidates.shape[0] == 0:
+         return 0, None
+      pivot_row = col + candidates[0]
+      if pivot_row != col:
+         aug[[col, pivot_row]] = aug[[pivot_row, col]]
+         det = -det
+      pivot = int(aug[col, col])
+      det = det * pivot % p
+      aug[col] = aug[col] * pow(pivot, p - 2, p) % p
+
+      rows = np.nonzero(aug[:, col])[0]
+      rows = rows[rows != col]
+      if rows.shape[0] > 0:
+         aug[rows] = (aug[rows] - aug[rows, col, np.newaxis] * aug[col]) % p
+   return det % p, aug[:, n:]
+
+
+def mod_hessenberg(C, p):
+   """return an upper Hessenberg matrix similar to C modulo p.
+
+   Elimination by similarity transforms, O(n^3), following Cohen's "A Course
+   in Computational Algebraic Number Theory", algorithm 2.2.9.
+   """
+   H = C % p
+   n = H.shape[0]
+   for m in range(n - 2):
+      candidates = np.nonzero(H[m+1:, m])[0]
+      if candidates.shape[0] == 0:
+         continue
+      i = m + 1 + candidates[0]
+      if i != m + 1: # swap rows and columns i and m+1
+         H[[i, m+1]] = H[[m+1, i]]
+         H[:, [i, m+1]] = H[:, [m+1, i]]
+      inverse = pow(int(H[m+1, m]), p - 2, p)
+      u = H[m+2:, m] * inverse % p
+      if not np.any(u):
+         continue
+      H[m+2:] = (H[m+2:] - u[:, np.newaxis] * H[m+1]) % p
+      H[:, m+1] = (H[:, m+1] + mod_dot(H[:, m+2:], u, p)) % p
+   return H
+
+
+def mod_charpoly(C, p):
+   """return the coefficients of det(x I - C) modulo p, lowest degree first."""
+   H = mod_hessenberg(C, p)
+   n = H.shape[0]
+   # polys[m] holds the characteristic polynomial of the leading m x m block
+   polys = np.zeros((n + 1, n + 1), dtype=np.int64)
+   polys[0, 0] = 1
+   for m in range(1, n + 1):
+      # (x - h_mm) * polys[m-1]
+      polys[m, 1:] = polys[m-1, :-1]
+      polys[m] = (polys[m] - H[m-1, m-1] * polys[m-1]) % p
+      # minus sum over i of h_im * (h_{i+1,i} ... h_{m,m-1}) * polys[i]
+      weights = np.zeros(m - 1, dtype=np.int64)
+      product = 1
+      for i in range(m - 2, -1, -1):
+         product = product * int(H[i+1, i]) % p
+         if product == 0:
+            break
+         weights[i] = int(H[i, m-1]) * product % p
+      if m > 1:
+         polys[m] = (polys[m] - mod_dot(weights, polys[:m-1], p)) % p
+   return polys[n]
+
+
+def mod_pencil_det(A0, A1, p):
+   """return the coefficients of det(A0 + t A1) modulo p, lowest degree first.
+
+   For a shift c with B = A0 + c A1 invertible, det(A0 + t A1) is
+   det(B) det(I + (t - c) B^-1 A1), and the second factor is the reversed
+   characteristic polynomial of -B^-1 A1 in t - c. So a single O(n^3)
+   elimination gives every coefficient, instead of one determinant per t.
+   Returns all zeros if no shift makes B invertible, i.e. the determinant
+   vanishes identically modulo p.
+   """
+   n = A0.shape[0]
+   # det(A0 + c A1) is nonzero for some c <= n unless it vanishes, and c = 1
+   # almost always works for alexander matrices, as |Delta(1)| = 1 for knots
+   for c in range(1, n + 2):
+      det_B, C = mod_solve((A0 + c * A1) % p, A1 % p, p)
+      if C is not None:
+         break
+   else:
+      return np.zeros(n + 1, dtype=np.int64)
+
+   # det(I + x C) = sum over m of (-1)^m a_{n-m} x^m, with a the charpoly of C
+   charpoly = mod_charpoly(C, p)
+   in_x = charpoly[::-1].copy()
+   in_x[1::2] = (-in_x[1::2]) % p
+
+   # substitute x = t - c by Horner's rule
+   in_t = np.zeros(n + 1, dtype=np.int64)
+   for coefficient in in_x[::-1]:
+      shifted = np.zeros(n + 1, dtype=np.int64)
+      shifted[1:] = in_t[:-1]
+      in_t = (shifted - c * in_t) % p
+      in_t[0] = (in_t[0] + coefficient) % p
+   return in_t * det_B % p
+
+
+def coefficient_bound_squared(A0, A1):
+   """return int, the square of a bound on every coefficient of det(A0 + t A1).
+
+   On |t| = 1 each entry of A0 + t A1 is at most |A0| + |A1| in absolute
+   value, so Hadamard's inequality bounds |det(A0 + t A1)| there by the
+   product of the row norms of |A0| + |A1|. Each coefficient is an average of
+   the determinant over the unit circle (Cauchy's formula), so it obeys the
+   same bound. Squared, to stay in exact integers.
+   """
+   entries = np.abs(A0) + np.abs(A1)
+   bound_squared = 1
+   for row_norm_squared in np.sum(entries * entries, axis=1).tolist():
+      bound_squared *= row_norm_squared
+   return bound_squared
+
+
+def crt_integer_poly(A0, A1):
+   """return the integer coefficients of det(A0 + t A1), lowest degree first.
+
+   Combines mod_pencil_det over successive primes with the Chinese remainder
+   theorem, in the symmetric range, until the product of the primes exceeds
+   twice the coefficient bound (see coefficient_bound_squared), at which
+   point every coefficient is determined exactly.
+
+   arguments:
+   A0, A1 - numpy arrays of ints with shape (n, n) - the pencil
+
+   return value:
+   list of Python ints - the coefficients, exact
+   """
+   A0 = np.asarray(A0, dtype=np.int64)
+   A1 = np.asarray(A1, dtype=np.int64)
+   bound_squared = coefficient_bound_squared(A0, A1)
+   primes = PRIMES
+   # each prime is above 2**24, so this many always suffice
+   needed = (bound_squared.bit_length() + 2) // 48 + 1
+   if needed > len(primes):
+      primes = largest_primes_below(1 << 25, needed)
+
+   modulus = 1
+   values = None
+   for p in primes:
+      residues = mod_pencil_det(A0 % p, A1 % p, p).tolist()
+      if values is None:
+         values = residues
+      else:
+         # lift each coefficient to the unique residue modulo modulus * p
+         inverse = pow(modulus, -1, p)
+         values = [v + modulus * ((r - v) * inverse % p) for v, r in zip(values, residues)]
+      modulus *= p
+      # |coefficient| <= bound < modulus / 2
+      if modulus * modulus > 4 * bound_squared:
+         break
+   return [v - modulus if v > modulus // 2 else v for v in values]
@@ -1,23 +1,187 @@
+import itertools
 import json
 
 import numpy as np
 
+from ..metrics import instrument
+
 # ============================ CHAIN UTILITIES ============================= #
 
-def pivot_rotations():
-   rotations_array = []
-   for angle in (np.pi / 2, np.pi, 1.5 * np.pi):
-      rotations_array.append(rot_matrix_x_3d(angle))
-      rotations_array.append(rot_matrix_y_3d(angle))
-      rotations_array.append(rot_matrix_z_3d(angle))
-   return np.array(rotations_array)
+def lattice_symmetry_group():
+   """return the 47 non-trivial symmetries of the cubic lattice.
+
+   These are all 3x3 signed permutation matrices except the identity, i.e. the
+   full octahedral group including reflections. Every one of them maps the
+   body-centered lattice directions onto themselves, so they are exactly the
+   moves available to the pivot algorithm.
+   """
+   symmetries = []
+   for permutation in itertools.permutations(np.eye(3, dtype=np.int64)):
+      for signs in itertools.product((1, -1), repeat=3):
+         symmetries.append(np.array(permutation) * np.array(signs)[:, np.newaxis])
+   return np.array(symmetries[1:]) # the first one is the identity
+
+
+class LatticeOccupancy:
+    """map of occupied lattice sites with constant time queries and updates.
+
+    Each site (x, y, z) is packed into a single int, 21 bits per coordinate,
+    so that membership is a plain hash lookup rather than a scan over the
+    whole chain. Every site also remembers the position along the chain of
+    the node sitting on it, which the pivot generator needs to tell the fixed
+    part of the chain from the part being moved. Shared by the worm and pivot
+    chain generators.
+
+    arguments:
+    nodes - iterable of lattice sites with shape (3,) - initially occupied
+    sites, in chain order
+    """
+    OFFSET = 1 << 20 # coordinates must lie in [-OFFSET, OFFSET)
+    KEY_WEIGHTS = np.array([1 << 42, 1 << 21, 1], dtype=np.int64)
+
+    def __init__(self, nodes=()):
+        self.sites = {}
+        for position, node in enumerate(nodes):
+            self.add(node, position)
+
+    @classmethod
+    def pack(cls, node):
+        """return the int key of lattice site node."""
+        x, y, z = (int(c) for c in node)
+        return ((x + cls.OFFSET) << 42) | ((y + cls.OFFSET) << 21) | (z + cls.OFFSET)
+
+    @classmethod
+    def pack_array(cls, nodes):
+        """return numpy array of the int keys of the integer sites nodes, shape (M, 3)."""
+        return (np.asarray(nodes, dtype=np.int64) + cls.OFFSET) @ cls.KEY_WEIGHTS
+
+    def add(self, node, position=None):
+        self.sites[self.pack(node)] = position
+
+    def discard(self, node):
+        self.sites.pop(self.pack(node), None)
+
+    def position(self, node):
+        """return the chain position of the node on site node, or None if free."""
+        return self.sites.get(self.pack(node))
+
+    def __contains__(self, node):
+        return self.pack(node) in self.sites
+
+    def __len__(self):
+        return len(self.sites)
+
+    def free_neighbours(self, node, dirs):
+        """return list of the sites node + dir, for dir in dirs, which are free."""
+        return [neighbour for neighbour in np.add(node, dirs) if neighbour not in self]
+
+
+# the 8 body-centered lattice directions, numbered as in code_to_chain
+CODE_DIRECTIONS = np.array([(1,1,1), (-1,-1,-1), (-1,1,1), (1,-1,-1), (-1,-1,1),
+                            (1,1,-1), (1,-1,1), (-1,1,-1)])
+# code of direction (x, y, z), looked up at 4*(x > 0) + 2*(y > 0) + (z > 0)
+SIGNS_TO_CODE = np.empty(8, dtype=np.int8)
+SIGNS_TO_CODE[(CODE_DIRECTIONS > 0) @ np.array([4, 2, 1])] = np.arange(8)
+
+
+def chains_to_codes(chains):
+   """return int8 step codes of chains, the inverse of codes_to_chains.
+
+   arguments:
+   chains - numpy array with shape (..., n+1, 3) - lattice chains
+
+   return value:
+   codes - numpy array of int8 with shape (..., n) - the code of every step
+   """
+   steps = np.diff(np.asarray(chains), axis=-2)
+   return SIGNS_TO_CODE[(steps > 0) @ np.array([4, 2, 1])]
+
+
+def codes_to_chains(codes):
+   """return chains starting at the origin from their int8 step codes.
+
+   Array version of code_to_chain, for any number of chains at once.
+
+   arguments:
+   codes - numpy array of ints with shape (..., n) - the code of every step
+
+   return value:
+   chains - numpy array with shape (..., n+1, 3) - the decoded chains
+   """
+   steps = CODE_DIRECTIONS[np.asarray(codes)]
+   origin = np.zeros(steps.shape[:-2] + (1, 3), dtype=steps.dtype)
+   return np.concatenate((origin, np.cumsum(steps, axis=-2)), axis=-2).astype(np.float64)
+
+
+def least_rotation(sequence):
+   """return int k such that sequence[k:] + sequence[:k] is the smallest rotation.
+
+   Booth's algorithm, O(n): a Knuth-Morris-Pratt failure function over the
+   sequence repeated twice, where every mismatch against a smaller element
+   moves the candidate start k past it.
+
+   argument:
+   sequence - list - any comparable elements
+   """
+   doubled = sequence + sequence
+   failure = [-1] * len(doubled)
+   k = 0
+   for j in range(1, len(doubled)):
+      element = doubled[j]
+      i = failure[j - k - 1]
+      while i != -1 and element != doubled[k + i + 1]:
+         if element < doubled[k + i + 1]:
+            k = j - i - 1
+         i = failure[i]
+      if element != doubled[k + i + 1]: # i == -1
+         if element < doubled[k]:
+            k = j
+         failure[j - k] = -1
+      else:
+         failure[j - k] = i + 1
+   return k
+
+
+def canonical_codes(chain):
+   """return the canonical step codes of chain, the same for all its copies.
+
+   Two chains are copies of each other when one is the other moved by a
+   symmetry of the lattice (see lattice_symmetry_group), walked backwards,
+   or, for closed chains, started from another node. All of these have the
+   same knot type, so the lexicographically smallest step code sequence over
+   all of them identifies the chain up to everything a knot classifier cares
+   about, and serves as a cache key.
+
+   For closed chains the smallest rotation of each of the 96 symmetric and
+   reversed copies is found by least_rotation, so the work is O(96 n) rather
+   than comparing all 96 n rotations.
+
+   argument:
+   chain - numpy array with shape (n+1, 3) - a lattice chain; it is taken as
+   closed, and so allowed to start from any node, if its ends coincide
+
+   return value:
+   codes - numpy array of int8 with shape (n,) - the canonical step codes
+   """
+   chain = np.asarray(chain)
+   steps = np.rint(np.diff(chain, axis=0)).astype(np.int64)
+   symmetries = np.concatenate((np.eye(3, dtype=np.int64)[np.newaxis],
+                                lattice_symmetry_group()))
+   images = steps @ symmetries.transpose(0, 2, 1)
+   images = np.concatenate((images, -images[:, ::-1]))
+   codes = SIGNS_TO_CODE[(images > 0) @ np.array([4, 2, 1])].tolist()
+
+   if np.array_equal(chain[0], chain[-1]):
+      rotations = [least_rotation(copy) for copy in codes]
+      codes = [copy[k:] + copy[:k] for copy, k in zip(codes, rotations)]
+   return np.array(min(codes), dtype=np.int8)
 
 
 class NumpyArrayEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.ndarray):
             return obj.tolist()
-        return json.JSONEncoder.default(self.obj)
+        return json.JSONEncoder.default(self, obj)
 
 
 # expected input: numpy ndarray
@@ -35,9 +199,53 @@ def chain_to_JSON(chain, file_dumps=False):
         return ""
 
     else:
-        print("Dumping NumPy Array into JSON string...")
         return json.dumps(data, cls=NumpyArrayEncoder)
 
+
+# Binary chain formats for the web viewer, all little-endian and headerless so
+# that they map straight onto a javascript typed array:
+#
+#   application/x-chain-codes   - the origin as 3 int16, then one int8 step
+#                                 code (see CODE_DIRECTIONS) per link
+#   application/x-chain-int16   - every vertex as 3 int16
+#   application/x-chain-float32 - every vertex as 3 float32
+#
+# Lattice coordinates of chains up to 32767 links fit in an int16.
+CODES_MIMETYPE = "application/x-chain-codes"
+INT16_MIMETYPE = "application/x-chain-int16"
+FLOAT32_MIMETYPE = "application/x-chain-float32"
+
+
+def chain_to_bytes(chain, mimetype):
+    """return bytes of chain in the binary format mimetype, see CODES_MIMETYPE.
+
+    arguments:
+    chain - numpy array with shape (n+1, 3) - a lattice chain
+    mimetype - str - one of CODES_MIMETYPE, INT16_MIMETYPE and FLOAT32_MIMETYPE
+    """
+    chain = np.asarray(chain)
+    if mimetype == CODES_MIMETYPE:
+        origin = np.rint(chain[0]).astype("<i2")
+        return origin.tobytes() + chains_to_codes(chain).astype(np.int8).tobytes()
+    if mimetype == INT16_MIMETYPE:
+        return np.rint(chain).astype("<i2").tobytes()
+    if mimetype == FLOAT32_MIMETYPE:
+        return chain.astype("<f4").tobytes()
+    raise ValueError("unknown chain format '{}'".format(mimetype))
+
+
+def bytes_to_chain(data, mimetype):
+    """return numpy array with shape (n+1, 3), the chain chain_to_bytes encoded as data."""
+    if mimetype == CODES_MIMETYPE:
+        origin = np.frombuffer(data[:6], dtype="<i2")
+        codes = np.frombuffer(data[6:], dtype=np.int8)
+        return codes_to_chains(codes) + origin
+    if mimetype == INT16_MIMETYPE:
+        return np.frombuffer(data, dtype="<i2").reshape(-1, 3).astype(np.float64)
+    if mimetype == FLOAT32_MIMETYPE:
+        return np.frombuffer(data, dtype="<f4").reshape(-1, 3).astype(np.float64)
+    raise ValueError("unknown chain format '{}'".format(mimetype))
+
 # ========================= PROJECTION UTILITIES =========================== #
 
 def rot_matrix_x_3d(alpha):
@@ -73,29 +281,162 @@ def rot_matrix_z_3d(alpha):
    )
 
 
+# the rotation of rot_saw_xy, built once: about x by -pi/3, then about y by
+# pi/6. Rotated this way, no two lattice vertices or edges of a chain line up
+# along z, so the xy projection of a rotated chain is regular.
+SAW_ROTATION_X = rot_matrix_x_3d(-np.pi / 3.0)
+SAW_ROTATION_Y = rot_matrix_y_3d(np.pi / 6.0)
+SAW_ROTATION = SAW_ROTATION_Y @ SAW_ROTATION_X
+
+
 def rot_saw_xy(saw):
     """return rotated saw by angles alpha and beta.
 
     prepares a saw so that it may be projected into the xy plane via art setting 
     z-comp of every vertex to zero. We don't actually do that here, but instead,
     rotate the saw so that such a projection will be regular.
+
+    Any leading axes are batch axes, so a whole batch of chains is rotated by
+    a single matrix multiply.
     
     parameters:
-    saw - numpy array of shape (N, 3) - the SAW which we will rotate
+    saw - numpy array of shape (..., N, 3) - the SAW which we will rotate
 
     return value:
     rotated_saw numpy array of same shape as saw - the rotated saw
     """
-    alpha = -np.pi / 3.0
-    beta = np.pi / 6.0
-    x_rot = rot_matrix_x_3d(alpha)
-    y_rot = rot_matrix_y_3d(beta)
-    rotated_saw = []
-    for vertex in saw:
-        rot_vertex = np.matmul(x_rot, vertex)
-        rot_vertex = np.matmul(y_rot, vertex)
-        rotated_saw.append(rot_vertex)
-    return np.array(rotated_saw)
+    return np.asarray(saw) @ SAW_ROTATION.T
+
+# ========================== REDUCTION UTILITIES ============================ #
+
+def triangle_is_pierced(a, b, c, starts, ends, touching=()):
+   """return True if any segment starts[i]ends[i] meets the closed triangle abc.
+
+   Exact for lattice coordinates, which stay integers through every cross and
+   triple product here. The segments in touching share exactly one of the
+   corners a or c with the triangle (they are the polygon edges either side
+   of it), so for them meeting that corner alone does not count: they only
+   pierce the triangle if they run into it within its plane.
+
+   arguments:
+   a, b, c - numpy arrays with shape (3,) - the corners of the triangle
+   starts, ends - numpy arrays with shape (M, 3) - the segments to test
+   touching - iterable of (i, corner) - indices of the segments in starts and
+   ends sharing the corner (a or c) with the triangle
+
+   return value:
+   boolean - True if some segment meets the triangle
+   """
+   normal = np.cross(b - a, c - a)
+   if not np.any(normal):
+      # a degenerate triangle lies on the two polygon edges ab and bc, which
+      # no other edge of an embedded polygon can touch
+      return False
+
+   touching = list(touching)
+   skip = np.zeros(starts.shape[0], dtype=bool)
+   for i, corner in touching:
+      skip[i] = True
+      other = ends[i] if np.array_equal(starts[i], corner) else starts[i]
+      direction = other - corner
+      if np.dot(normal, direction) == 0:
+         # coplanar, so it enters the triangle iff it heads between the two
+         # edges leaving the shared corner
+         u, w = (b - a, c - a) if np.array_equal(corner, a) else (b - c, a - c)
+         corner_normal = np.cross(u, w)
+         if np.dot(np.cross(u, direction), corner_normal) >= 0 and \
+               np.dot(np.cross(direction, w), corner_normal) >= 0:
+            return True
+   starts, ends = starts[~skip], ends[~skip]
+
+   side_start = (starts - a) @ normal
+   side_end = (ends - a) @ normal
+   straddles = side_start * side_end <= 0
+   coplanar = (side_start == 0) & (side_end == 0)
+
+   # a segment crossing the plane passes through the triangle iff the three
+   # triple products of its direction with the corners share a sign
+   direction = ends - starts
+   volumes = np.stack([np.einsum('ij,ij->i', direction, np.cross(p - starts, q - starts))
+                       for p, q in ((a, b), (b, c), (c, a))], axis=1)
+   through = np.all(volumes >= 0, axis=1) | np.all(volumes <= 0, axis=1)
+   if np.any(straddles & ~coplanar & through):
+      return True
+
+   # a segment in the plane of the triangle meets it iff an endpoint lies
+   # inside it or it crosses one of its edges, tested in 2D on the
+   # coordinate plane the triangle projects onto best
+   if np.any(coplanar):
+      axes = np.delete(np.arange(3), np.argmax(np.abs(normal)))
+      tri = np.array([a, b, c])[:, axes]
+      seg_starts, seg_ends = starts[coplanar][:, axes], ends[coplanar][:, axes]
+      def orient(p, q, r):
+         return (q[..., 0] - p[..., 0])*(r[..., 1] - p[..., 1]) - \
+                (q[..., 1] - p[..., 1])*(r[..., 0] - p[..., 0])
+      for point in (seg_starts, seg_ends):
+         sides = np.stack([orient(tri[i], tri[(i+1) % 3], point) for i in range(3)], axis=1)
+         if np.any(np.all(sides >= 0, axis=1) | np.all(sides <= 0, axis=1)):
+            return True
+      for i in range(3):
+         p, q = tri[i], tri[(i+1) % 3]
+         d1, d2 = orient(p, q, seg_starts), orient(p, q, seg_ends)
+         d3, d4 = orient(seg_starts, seg_ends, p), orient(seg_starts, seg_ends, q)
+         if np.any((d1 * d2 <= 0) & (d3 * d4 <= 0)):
+            return True
+   return False
+
+
+def reduce_polygon(saw):
+   """return the vertices of saw left after deleting every removable vertex.
+
+   A polygon reduction in the style of Koniaris and Muthukumar (KMT): the
+   vertex b between neighbours a and c may be deleted, replacing edges ab and
+   bc by ac, whenever no other edge of the polygon meets the triangle abc, as
+   sliding b to the midpoint of ac is then an isotopy. Vertices are swept
+   over until none can be deleted, which for random lattice chains usually
+   leaves a small fraction of them, and with them of the crossings.
+
+   saw is taken as the closed polygon with edges between consecutive vertices
+   plus the edge from its last vertex back to its first, and the first and
+   last vertices are never deleted. A saw closed by its first vertex repeated
+   at the end, as generate_closed_chain returns it, is reduced without the
+   repeat, which is put back at the end of the result.
+
+   argument:
+   saw - numpy array with shape (N, 3) - the chain to reduce
+
+   return value:
+   reduced - numpy array with shape (M, 3), M <= N - the remaining vertices of
+   saw, in order
+   """
+   saw = np.asarray(saw)
+   if saw.shape[0] > 1 and np.array_equal(saw[0], saw[-1]):
+      reduced = reduce_polygon(saw[:-1])
+      return np.concatenate((reduced, reduced[:1]))
+   keep = list(range(saw.shape[0]))
+   changed = True
+   while changed:
+      changed = False
+      i = 1
+      while i < len(keep) - 1 and len(keep) > 3:
+         vertices = saw[keep]
+         m = len(keep)
+         # edges of the polygon other than the two being replaced; edge e
+         # joins vertex e to vertex e+1, and edge m-1 closes the polygon
+         edges = [e for e in range(m) if e not in (i - 1, i)]
+         starts = vertices[edges]
+         ends = vertices[[(e + 1) % m for e in edges]]
+         # the edges either side, touching corners a and c respectively
+         touching = [(edges.index((i - 2) % m), vertices[i - 1]),
+                     (edges.index(i + 1), vertices[i + 1])]
+         if triangle_is_pierced(vertices[i - 1], vertices[i], vertices[i + 1],
+                                starts, ends, touching):
+            i += 1
+         else:
+            del keep[i]
+            changed = True
+   return saw[keep]
+
 
 # ========================== ALEXANDER UTILITIES ============================ #
 
@@ -223,6 +564,61 @@ def find_intersection_2D_vec(p1, p2, p3, p4):
          return np.array([(intersect.tolist(), x[0])], dtype=dtype) # return both intersect and param values
 
 
+def find_intersections_2D_batch(p1, p2, p3, p4):
+   """from M pairs of line segments p1p2 and p3p4, return all intersections.
+
+   This is the array version of find_intersection_2D_vec: the i-th row of each
+   argument describes one pair of segments, and every pair is solved at once
+   with the same Cramer's Rule as find_intersection_2D, so no Python-level
+   loop is needed. An intersection counts if it lies strictly inside both
+   segments by their parameters, rather than inside their bounding boxes as
+   in validate_intersect_in_segments, so a segment parallel to an axis, as in
+   reduced chains, still crosses.
+
+   arguments:
+   p1 - numpy array of doubles with shape (M, 2) - first points of segments p1p2
+   p2 - numpy array of doubles with shape (M, 2) - second points of segments p1p2
+   p3 - numpy array of doubles with shape (M, 2) - first points of segments p3p4
+   p4 - numpy array of doubles with shape (M, 2) - second points of segments p3p4
+
+   return value(s):
+   coords - numpy array of doubles with shape (M, 2) - the intersections
+   order_param - numpy array of doubles with shape (M,) - the parameter along
+   the reference segment p1p2, as explained in find_intersection_2D_vec
+   found - numpy array of bools with shape (M,) - True where the intersection
+   exists and lies in both segments; coords and order_param are garbage elsewhere
+   """
+   a1 = p2[:,1] - p1[:,1]
+   b1 = p1[:,0] - p2[:,0]
+   c1 = a1*p1[:,0] + b1*p1[:,1]
+
+   a2 = p4[:,1] - p3[:,1]
+   b2 = p3[:,0] - p4[:,0]
+   c2 = a2*p3[:,0] + b2*p3[:,1]
+
+   det = a1*b2 - a2*b1
+   found = det != 0 # lines are parallel where det vanishes, no intersection
+   with np.errstate(divide='ignore', invalid='ignore'):
+      x = (c1*b2 - c2*b1) / det
+      y = (a1*c2 - a2*c1) / det
+      # parameter along p1p2, i.e. p1 + t*(p2 - p1) is the intersection
+      order_param = ((p3[:,0] - p1[:,0])*a2 + (p3[:,1] - p1[:,1])*b2) / det
+      # and likewise along p3p4
+      other_param = ((p3[:,0] - p1[:,0])*a1 + (p3[:,1] - p1[:,1])*b1) / det
+
+      # identical tangent directions, mirrors the check in find_intersection_2D_vec
+      v_1 = p2 - p1
+      v_2 = p4 - p3
+      v_1_normalized = v_1 / np.sqrt(np.sum(v_1*v_1, axis=1))[:,np.newaxis]
+      v_2_normalized = v_2 / np.sqrt(np.sum(v_2*v_2, axis=1))[:,np.newaxis]
+   found &= ~np.all(v_1_normalized == v_2_normalized, axis=1)
+
+   for param in (order_param, other_param):
+      found &= (0.0 < param) & (param < 1.0)
+
+   return np.stack((x, y), axis=1), order_param, found
+
+
 def is_underpass(k, j, intersect, saw):
    """return True if segment pkpk_1 is an underpass of pjpj_1, else return False.
    
@@ -252,6 +648,37 @@ def is_underpass(k, j, intersect, saw):
    return True if (zj - zk > EPS) else False
 
 
+def is_underpass_vec(k, j, intersect, saw):
+   """return array of bools, True where segment pkpk_1 is an underpass of pjpj_1.
+
+   Array version of is_underpass, evaluating many crossings at once.
+
+   arguments:
+   k - numpy array of ints with shape (I,) - the indices of nodes pk within the SAW
+   j - numpy array of ints with shape (I,) - the indices of nodes pj within the SAW
+   intersect - numpy array with shape (I, 2) - the intersections within the
+   projection, with format (x, y)
+   saw - numpy array with shape (N, 3) - the SAW where underpasses will be
+   found from
+
+   return value:
+   numpy array of bools with shape (I,) - True where pkpk_1 is an underpass
+   """
+   saw = np.asarray(saw)
+   rows = np.arange(np.shape(intersect)[0])
+
+   def z_at_intersect(p, p_1):
+      # interpolate along the longer of the x and y extents of the segment,
+      # so that segments parallel to the y axis work too
+      axis = np.argmax(np.abs(p_1[:,:2] - p[:,:2]), axis=1)
+      t = (intersect[rows, axis] - p[rows, axis]) / (p_1[rows, axis] - p[rows, axis])
+      return p[:,2] + (p_1[:,2] - p[:,2])*t
+
+   zk = z_at_intersect(saw[k], saw[k+1])
+   zj = z_at_intersect(saw[j], saw[j+1])
+   return zj - zk > EPS
+
+
 def order_intersections(intersections):
    """returns a sorted list of intersections according to projection orientation.
    
@@ -262,56 +689,176 @@ def order_intersections(intersections):
    ordering parameter for each segment the first time it is encountered as an intersection
    
    return value:
-   the sorted version of intersections
+   the sorted version of intersections, by segment and then by order parameter
+   along it, i.e. in the order they are met walking along the knot
    """
-   # create temp array to be used as the sorting key
-   temp = np.zeros(intersections.shape, dtype=[('f0',np.uintc,(2,)),('f1',np.float64)])
-   # get first two columns of the indices
-   temp['f0'] = intersections['indices'][:,:2]
-   temp['f1'] = intersections['order_param']
-   # this step is literally magic as far as I know
-   return intersections[np.argsort(temp)]
+   # sort on the segment indices as numbers, not on the raw bytes of a
+   # structured key, which put segment 259 before segment 7
+   return intersections[np.lexsort((intersections['order_param'],
+                                    intersections['indices'][:,1],
+                                    intersections['indices'][:,0]))]
 
 
-def collect_all_intersections(proj):
+def brute_force_candidate_pairs(proj):
+   """return every ordered pair (k, j) of non-adjacent segments of proj.
+
+   The pairs are returned in row-major order (k first, then j), which is the
+   order the original double loop visited them in.
+
+   argument:
+   proj - numpy array with shape (N, 2) - the regular projection of our saw
+
+   return value:
+   k, j - numpy arrays of ints with shape (M,) - the candidate segment pairs
+   """
+   num_segments = proj.shape[0] - 1
+   return np.nonzero(np.abs(np.subtract.outer(np.arange(num_segments),
+                                              np.arange(num_segments))) > 1)
+
+
+def grid_candidate_pairs(proj):
+   """return ordered pairs (k, j) of non-adjacent segments sharing a grid cell.
+
+   Uniform grid bucketing: the plane is cut into square cells at least as
+   large as the biggest segment bounding box, so every segment lands in at
+   most 2x2 cells, and only segments sharing a cell are paired up. For
+   lattice chains the number of segments per cell is bounded, so the work
+   scales with N plus the number of crossings instead of N^2. Two segments
+   can only cross if their bounding boxes overlap, which in turn means they
+   share a cell, so no crossing is ever missed.
+
+   The pairs are returned in the same row-major order as
+   brute_force_candidate_pairs, though collect_all_intersections sorts the
+   crossings it finds either way.
+
+   argument:
+   proj - numpy array with shape (N, 2) - the regular projection of our saw
+
+   return value:
+   k, j - numpy arrays of ints with shape (M,) - the candidate segment pairs
+   """
+   num_segments = proj.shape[0] - 1
+   if num_segments < 3:
+      return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+   lower = np.minimum(proj[:-1, :2], proj[1:, :2])
+   upper = np.maximum(proj[:-1, :2], proj[1:, :2])
+   cell_size = max(np.max(upper - lower), EPS)
+   lower_cell = np.floor((lower - lower.min(axis=0)) / cell_size).astype(np.int64)
+   upper_cell = np.floor((upper - lower.min(axis=0)) / cell_size).astype(np.int64)
+   num_rows = upper_cell[:,1].max() + 1
+
+   # (cell, segment) entries for the up to 2x2 cells each segment touches
+   cells, segments = [], []
+   for dx in (0, 1):
+      for dy in (0, 1):
+         cell = lower_cell + (dx, dy)
+         touches = np.all(cell <= upper_cell, axis=1)
+         cells.append(cell[touches, 0] * num_rows + cell[touches, 1])
+         segments.append(np.nonzero(touches)[0])
+   cells = np.concatenate(cells)
+   segments = np.concatenate(segments)
+   order = np.argsort(cells, kind='stable')
+   cells, segments = cells[order], segments[order]
+
+   # pair every entry with every entry of its own cell
+   _, cell_start, cell_count = np.unique(cells, return_index=True, return_counts=True)
+   entry_count = np.repeat(cell_count, cell_count)
+   entry_start = np.repeat(cell_start, cell_count)
+   first = np.repeat(np.arange(cells.shape[0]), entry_count)
+   block_start = np.repeat(np.cumsum(entry_count) - entry_count, entry_count)
+   second = np.repeat(entry_start, entry_count) + np.arange(first.shape[0]) - block_start
+   k, j = segments[first], segments[second]
+
+   # drop adjacent pairs, then pairs seen in more than one cell
+   keep = np.abs(k - j) > 1
+   pair_keys = np.unique(k[keep] * num_segments + j[keep])
+   return pair_keys // num_segments, pair_keys % num_segments
+
+
+# the available strategies for collecting the candidate pairs of segments
+CROSSING_FINDERS = {"brute": brute_force_candidate_pairs,
+                    "grid": grid_candidate_pairs}
+
+
+@instrument("collect_all_intersections",
+            counts=lambda intersections: {"intersections": intersections.shape[0]})
+def collect_all_intersections(proj, method="brute"):
    """return structured array of intersection coords and surrounding indices.
    
    Important to note is that this function collects intersections twice, so
    the returned array will always have even shape along the first axis.
 
-   We run a function order_intersections() at the end as our naive alg may
-   collect intersections out of order according to the projection's orientation.
+   The rows are returned in the order the crossings are met walking along
+   the knot: by the segment k of indices (k, k+1, j, j+1), then by the order
+   parameter along it (see order_intersections).
+
+   The candidate pairs of segments are chosen by method: "brute" tests all
+   pairs, which is cheapest for short chains, while "grid" only tests pairs
+   sharing a grid cell (see grid_candidate_pairs) and is meant for long chains.
 
    argument:
    proj - numpy array with shape (N, 2) - the regular projection of our saw
+   method - str - key of CROSSING_FINDERS, either "brute" or "grid"
 
    return value:
    return_val - numpy array with shape (I, 3) - the structured array which
    contains the intersection coordinates, the encapsulating indices, and
    the 'order parameter' as explained in find_intersection_2D_vec
    """
+   if method not in CROSSING_FINDERS:
+      raise ValueError("unknown crossing finder '{}', expected one of {}".format(
+                       method, list(CROSSING_FINDERS)))
+
+   # the finders may return the candidate pairs in any order, the rows are
+   # put in knot order by order_intersections() below
+   k, j = CROSSING_FINDERS[method](proj)
+   starts = proj[:-1, :2]
+   ends = proj[1:, :2]
+   coords, order_param, found = find_intersections_2D_batch(starts[k], ends[k],
+                                                           starts[j], ends[j])
+   k, j = k[found], j[found]
 
-   intersections = []
-   for k in np.arange(proj.shape[0]-1):
-      for j in np.arange(proj.shape[0]-1):
-         if j == k-1 or j == k or j == k+1:
-            continue
-         pk = proj[k][:2]
-         pk_1 = proj[k+1][:2]
-         pj = proj[j][:2]
-         pj_1 = proj[j+1][:2]
-         intersection = find_intersection_2D_vec(pk, pk_1, pj, pj_1)
-         if intersection is not None:
-            this_intersection = (intersection['coords'].tolist()[0], [k,k+1,j,j+1], intersection['order_param'][0])
-            intersections.append(this_intersection)
    # dtype to be used for the structured array
    dtype = [('coords', np.float64, (2,)), ('indices', np.uintc, (4,)), ('order_param', np.float64)]
-   intersections_as_array = np.array(intersections, dtype=dtype)
+   intersections_as_array = np.empty(k.shape[0], dtype=dtype)
+   intersections_as_array['coords'] = coords[found]
+   intersections_as_array['indices'] = np.stack((k, k+1, j, j+1), axis=1)
+   intersections_as_array['order_param'] = order_param[found]
    return_val = order_intersections(intersections_as_array)
    return return_val
 
 
-def get_underpass_indices(proj, saw):
+def build_crossing_table(proj, saw, method="brute"):
+   """return the crossing table of saw: every intersection plus its over/under flag.
+
+   This is the output of collect_all_intersections with one more field,
+   'is_underpass', precomputed via is_underpass_vec. It is meant to be built
+   once per chain and then shared by get_underpass_indices and
+   assign_generator_to_underpasses, so that neither has to collect the
+   intersections or evaluate is_underpass again.
+
+   arguments:
+   proj - numpy array with shape (N, 2) - the regular projection of saw
+   saw - numpy array with shape (N, 3) - the SAW we obtain underpasses from
+   method - str - the crossing finder, as in collect_all_intersections
+
+   return value:
+   crossing_table - structured numpy array with shape (I,) and fields 'coords',
+   'indices', 'order_param' and 'is_underpass', in order of occurence
+   """
+   intersections = collect_all_intersections(proj, method)
+   dtype = intersections.dtype.descr + [('is_underpass', np.bool_)]
+   crossing_table = np.empty(intersections.shape, dtype=dtype)
+   for name in intersections.dtype.names:
+      crossing_table[name] = intersections[name]
+   crossing_table['is_underpass'] = is_underpass_vec(
+      intersections['indices'][:,0], intersections['indices'][:,2],
+      intersections['coords'], saw)
+   return crossing_table
+
+
+def get_underpass_indices(proj, saw, method="brute", crossing_table=None):
    """return array of underpass indices, in order of occurence.
    
    Returns the 'encapsulating' indices of the nodes surrounding a given
@@ -330,66 +877,76 @@ def get_underpass_indices(proj, saw):
    parameters:
    saw - numpy array with shape (N, 3) - the SAW we obtain underpasses from
    proj - numpy array with shape (N, 2) - the regular projection of saw
+   method - str - the crossing finder, as in collect_all_intersections
+   crossing_table - structured numpy array - the output of build_crossing_table,
+   built here if not given
 
    return value:
    underpass_indices - numpy array with shape (I / 2, 4) - array of encapsulating
    indices of all underpasses, in order of occurence
    """
-   intersections = collect_all_intersections(proj)
-   intersection_indices = intersections["indices"]
-   intersection_coords = intersections["coords"]
-   num_intersections = np.shape(intersections)[0]
-   num_underpasses = num_intersections // 2
-
-   underpass_indices = np.empty((num_underpasses,4), dtype=np.uintc)
-   j = 0
-
-   for i in np.arange(num_intersections):
-      if is_underpass(intersection_indices[i,0], intersection_indices[i,2],
-                      intersection_coords[i], saw):
-         underpass_indices[j] = intersection_indices[i]
-         j += 1
+   if crossing_table is None:
+      crossing_table = build_crossing_table(proj, saw, method)
 
-   return underpass_indices
+   return crossing_table["indices"][crossing_table["is_underpass"]]
 
 
 def assign_underpass_types(underpasses, proj, underpass_info):
    """return None, only modify elements of underpass_info by assigning underpass type."""
-   for l in np.arange(np.shape(underpasses)[0]):
-      # collect underpass type
-      pk = proj[underpasses[l][1]][:2]
-      pk_1 = proj[underpasses[l][2]][:2]
-      pj = proj[underpasses[l][3]][:2]
-      v1 = np.subtract(pk, pj)
-      v2 = np.subtract(pk, pk_1)
-      if np.cross(v1, v2) == 1: # Type I
-         underpass_info[l,0] = 0
-      else: # Type II
-         underpass_info[l,0] = 1
-
-
-def assign_generator_to_underpasses(underpass_indices, intersection_indices,
-                                    intersection_coords, underpass_info, saw):
-   """return None, modify elements of underpass_info by assigning overpass generators"""
-   #using indexes is just..easier
-   for i in np.arange(np.shape(underpass_indices)[0]):
-      # below finds the index of the current underpass within intersections, then decrements
-      j = np.nonzero(np.all((intersection_indices-underpass_indices[i])==0,axis=1))[0][0] - 1
-      while True:
-         if j < 0:
-            j = np.shape(intersection_indices)[0] - 1
-         if not is_underpass(intersection_indices[j,0], intersection_indices[j,2],
-                             intersection_coords[j], saw):
-
-            underpass_k = np.roll(intersection_indices[j], 2)
-            k = np.nonzero(np.all((underpass_indices-underpass_k)==0,axis=1))[0][0]
-            underpass_info[k, 1] = i
-            j -= 1
-         else:
-            break
-
-
-def pre_alexander_compile(saw, proj):
+   underpasses = np.asarray(underpasses, dtype=np.intp)
+   # collect underpass type
+   pk = proj[underpasses[:,1], :2]
+   pk_1 = proj[underpasses[:,2], :2]
+   pj = proj[underpasses[:,3], :2]
+   v1 = np.subtract(pk, pj)
+   v2 = np.subtract(pk, pk_1)
+   cross = v1[:,0]*v2[:,1] - v1[:,1]*v2[:,0]
+   # the sign of the cross product is the handedness, whatever the coordinates
+   underpass_info[:,0] = np.where(cross > 0, 0, 1) # Type I is 0, Type II is 1
+
+
+def assign_generator_to_underpasses(underpass_indices, crossing_table, underpass_info):
+   """return None, modify elements of underpass_info by assigning overpass generators.
+
+   Every overpass lying between two consecutive underpasses (along the
+   orientation of the projection) belongs to the generator of the later
+   underpass. Rather than scanning the crossing table for every underpass, we
+   hash each underpass quadruple to its number, precompute the next underpass
+   row for every row of the table, and assign all overpasses in one pass, so
+   this is linear in the number of crossings.
+   """
+   intersection_indices = crossing_table["indices"]
+   intersection_is_underpass = crossing_table["is_underpass"]
+   num_intersections = np.shape(intersection_indices)[0]
+   if np.shape(underpass_indices)[0] == 0:
+      return
+
+   # index from underpass quadruple to underpass number
+   underpass_number = {tuple(quadruple): i for i, quadruple
+                       in enumerate(np.asarray(underpass_indices).tolist())}
+
+   # next underpass row along the orientation for every row, wrapping around
+   rows = np.arange(num_intersections)
+   next_underpass_row = np.where(intersection_is_underpass, rows, num_intersections)
+   next_underpass_row = np.minimum.accumulate(next_underpass_row[::-1])[::-1]
+   next_underpass_row[next_underpass_row == num_intersections] = \
+      np.nonzero(intersection_is_underpass)[0][0]
+
+   # row of the table to underpass number, for the underpass rows only
+   row_to_underpass = np.full(num_intersections, -1, dtype=np.intp)
+   for row in np.nonzero(intersection_is_underpass)[0]:
+      row_to_underpass[row] = underpass_number[tuple(intersection_indices[row].tolist())]
+
+   for row in np.nonzero(~intersection_is_underpass)[0]:
+      # the same crossing seen from the other segment is its underpass
+      k, k_1, j, j_1 = intersection_indices[row].tolist()
+      underpass_info[underpass_number[(j, j_1, k, k_1)], 1] = \
+         row_to_underpass[next_underpass_row[row]]
+
+
+@instrument("pre_alexander_compile",
+            counts=lambda underpass_info: {"underpasses": underpass_info.shape[0]})
+def pre_alexander_compile(saw, proj, method="brute", crossing_table=None):
    """return a list of underpass info, including underpass type and generator.
    
    Collects two pieces of information: the types of each underpass (either type
@@ -399,22 +956,92 @@ def pre_alexander_compile(saw, proj):
    arguments:
    saw - numpy array with shape (N, 3) - the saw which we are running analysis on
    proj - numpy array with shape (N, 2) - the regular projection of saw
+   method - str - the crossing finder, as in collect_all_intersections
+   crossing_table - structured numpy array - the output of build_crossing_table,
+   built here if not given
    
    return value:
    underpass_info - a numpy array with shape (I, 2) where I is the number of 
    underpasses - the relevant info which will be used to populate alexander matrix
    """
-   intersections = collect_all_intersections(proj)
-   underpass_indices = get_underpass_indices(proj, saw)
+   # the crossing table is the expensive part, so compute it once and share it
+   if crossing_table is None:
+      crossing_table = build_crossing_table(proj, saw, method)
+   underpass_indices = get_underpass_indices(proj, saw, crossing_table=crossing_table)
 
    underpass_info = np.zeros((np.shape(underpass_indices)[0],2),dtype=np.intc) 
 
    assign_underpass_types(underpass_indices, proj, underpass_info)
-   assign_generator_to_underpasses(underpass_indices, intersections["indices"],
-                                   intersections["coords"], underpass_info, saw)
+   assign_generator_to_underpasses(underpass_indices, crossing_table, underpass_info)
 
    return underpass_info
 
+def gauss_code(crossing_table):
+   """return the gauss code of the diagram described by crossing_table.
+
+   Walking along the projection, every crossing is met twice, once on each
+   strand. The gauss code lists the crossings in that order, each one
+   numbered by its pair of segments, along with whether we pass under it.
+
+   return value:
+   crossings - list of ints - the crossing met at each step
+   under - list of bools - True where we pass under that crossing
+   """
+   indices = crossing_table["indices"]
+   k = np.minimum(indices[:,0], indices[:,2]).astype(np.int64)
+   j = np.maximum(indices[:,0], indices[:,2]).astype(np.int64)
+   crossings = (k * (np.max(j, initial=0) + 1) + j).tolist()
+   return crossings, crossing_table["is_underpass"].tolist()
+
+
+def reidemeister_simplify(crossings, under):
+   """return the gauss code left after undoing Reidemeister I and II moves.
+
+   A Reidemeister I kink is a crossing met twice in a row. A Reidemeister II
+   bigon is a pair of crossings met in a row on both strands, passing under
+   (or over) both of them on one strand. In both cases no other part of the
+   diagram can reach the loop or bigon, so removing the crossings keeps the
+   knot type. We remove them until none are left. Whatever the knot is, the
+   number of crossings left bounds it: fewer than 3 means the unknot.
+
+   arguments:
+   crossings, under - lists - the gauss code, as returned by gauss_code
+
+   return value:
+   crossings, under - lists - the simplified gauss code
+   """
+   crossings, under = list(crossings), list(under)
+   changed = True
+   while changed and crossings:
+      changed = False
+      n = len(crossings)
+      positions = {}
+      for i, c in enumerate(crossings):
+         positions.setdefault(c, []).append(i)
+
+      removed = set()
+      for i in range(n):
+         a, b = crossings[i], crossings[(i+1) % n]
+         if a in removed or b in removed:
+            continue
+         if a == b: # Reidemeister I
+            removed.add(a)
+            continue
+         if under[i] != under[(i+1) % n]:
+            continue
+         other_a = [p for p in positions[a] if p != i][0]
+         other_b = [p for p in positions[b] if p != (i+1) % n][0]
+         if (other_a - other_b) % n in (1, n-1): # Reidemeister II
+            removed.update((a, b))
+
+      if removed:
+         changed = True
+         kept = [i for i in range(n) if crossings[i] not in removed]
+         crossings = [crossings[i] for i in kept]
+         under = [under[i] for i in kept]
+   return crossings, under
+
+
 # ============================== TEST UTILITIES ============================= #
 
 from pathlib import Path
@@ -424,8 +1051,7 @@ JSON_EXTENSION = ".json"
 #https://faculty.washington.edu/cemann/S0218216509007373.pdf
 def code_to_chain(code):
    """From codes at above website return json array of code chain rep."""
-   directions = np.array([(1,1,1), (-1,-1,-1), (-1,1,1), (1,-1,-1), (-1,-1,1),
-                          (1,1,-1), (1,-1,1), (-1,1,-1)])
+   directions = CODE_DIRECTIONS
    chain = np.zeros((len(code)+1,3))
    chain_index = 1
    for number in code:
@@ -1,33 +1,49 @@
 import numpy as np
 
+from .metrics import instrument
 from .private.utilities import rot_saw_xy
 
 
+@instrument("find_reg_project")
 def find_reg_project(saw):
-    """return regular projection of SAW via rotation by irrational angle.
-    
-    I like this one. Finds a regular projection of the SAW by rotating 
-    the axes CCW (or conversely, by rotating the SAW CW) by an irrational
-    angle, thus guaranteeing that no multiple points are triple, and that
-    no two vertices are projected to the same point (vertices are at most
-    single points).
+    """return regular projection of SAW onto the xy plane of its rotation by rot_saw_xy.
+
+    The saw is rotated by SAW_ROTATION, whose angles are irrational multiples
+    of the lattice directions, so that in the xy plane no multiple points are
+    triple and no two vertices are projected to the same point. The
+    projection is then the rotated saw with its z components set to zero.
+    saw itself is not modified.
 
-    (Note that the angle is completely arbitrary, so I chose PI/3)
     (CHANGELOG: added second y-rotation by pi / 6 on 10/04/2021)
-    
+
     argument:
-    saw - numpy array of shape (N, 3) - the SAW which we wish to find a com
+    saw - numpy array of shape (N, 3) - the SAW, unrotated
     
     return value:
-    projection - numpy array of shape (N, 2) - the projection of the saw
+    projection - numpy array of shape (N, 3) - the projection of the rotated
+    saw, with z components zero
     """
-    rotated_saw = rot_saw_xy(saw)
-    projection = []
-    for vertex in saw:
-        project_vertex = vertex
-        project_vertex[2] = 0.0 # project to xy plane :)
-        projection.append(project_vertex)
+    projection = rot_saw_xy(np.asarray(saw, dtype=np.float64))
+    projection[..., 2] = 0.0 # project to xy plane :)
+    return projection
 
-    projection = np.array(projection)
 
-    return projection
+def project_chains(chains):
+    """return (rotated_chains, projections) for a whole batch of chains at once.
+
+    The batch version of rot_saw_xy and find_reg_project together: the
+    rotated chains come from one matrix multiply by the precomputed
+    SAW_ROTATION, and the projections are their xy components, which
+    find_reg_project keeps. chains is left untouched and shares no memory with either result,
+    so they are safe to hand to other stages.
+
+    argument:
+    chains - numpy array of shape (B, N, 3) - the chains to project
+
+    return value:
+    rotated_chains - numpy array of shape (B, N, 3) - as rot_saw_xy gives
+    projections - numpy array of shape (B, N, 2) - as find_reg_project gives,
+    without the zero z components
+    """
+    rotated_chains = rot_saw_xy(np.asarray(chains, dtype=np.float64))
+    return rotated_chains, rotated_chains[..., :2].copy()
@@ -1,21 +1,56 @@
+import gzip
 import io
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
 
 import numpy as np
-from flask import Response, jsonify, render_template, request
+from flask import Response, jsonify, render_template, request, stream_with_context
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 from matplotlib.figure import Figure
 
 from app import app
 
-from .alexander import populate_alexander_matrix
-from .generate_chain import generate_closed_chain
-from .monte_carlo import basic_monte_carlo_sim
-from .private.utilities import chain_to_JSON
+from .chain_pool import ChainPool
+from .jobs import JobManager
+from .metrics import emit, metrics
+from .pipeline import (MAX_CHAINS_PER_REQUEST, MAX_NODES, chain_source, crossing_stage,
+                       invariant_stage, projection_stage, summaries_to_bytes, summary_stage,
+                       upload_source)
+from .private.utilities import (CODES_MIMETYPE, FLOAT32_MIMETYPE, INT16_MIMETYPE,
+                                chain_to_bytes)
+from .sample_store import SampleStore
 
 N  = 100
 NUM_CHAINS = 500
-
-from .projection import find_reg_project, rot_saw_xy
+HISTOGRAM_BINS = 50
+MAX_HISTOGRAM_BINS = 500
+# chains ready to hand out by /data_helper, producers start on first request
+CHAIN_POOL = ChainPool(N)
+# monte carlo samples behind /plot.png, kept in SAMPLE_STORE_DIR if set
+SAMPLE_STORE = SampleStore(N, shift=True,
+                           checkpoint_dir=os.environ.get("SAMPLE_STORE_DIR") or None)
+# rendered plots by (N, bins, number of samples), least recently used first,
+# shared by the request threads under PLOT_CACHE_LOCK; see plot_png
+PLOT_CACHE = OrderedDict()
+PLOT_CACHE_LOCK = threading.Lock()
+PLOT_CACHE_SIZE = 16
+# formats /data_helper can answer in, picked by the Accept header; json, as
+# before, unless a binary one is asked for (see chain_to_bytes)
+CHAIN_MIMETYPES = ["application/json", CODES_MIMETYPE, INT16_MIMETYPE, FLOAT32_MIMETYPE]
+# responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 256
+# formats /chains streams its results in: one json object per line, or
+# fixed size binary records (see SUMMARY_DTYPE)
+NDJSON_MIMETYPE = "application/x-ndjson"
+SUMMARY_MIMETYPE = "application/x-chain-summaries"
+RESULTS_PER_CHUNK = 100
+# background monte carlo jobs, kept in JOBS_DIR, or else under the instance
+# folder rather than wherever the server was started; workers start on first
+# request
+JOB_MANAGER = JobManager(os.environ.get("JOBS_DIR") or os.path.join(app.instance_path, "jobs"))
 
 
 @app.route("/data_helper", methods=["GET", "POST"])
@@ -25,38 +60,240 @@ def data_helper():
     This function handles GET and POST requests from our web app. So far the 
     POST requests are quite simple, but in the future, we may handle more
     complex tasks here. The GET request is likewise very simply, only handing
-    over the serialized SAW information to the web app."""
+    over the serialized SAW information to the web app. The SAW is taken from
+    CHAIN_POOL, which only generates it on the spot when it has run dry."""
     if request.method == "POST": # POST request
-        print("Incoming..")
-        print(request.get_json())  # parse as JSON
+        emit("data_helper_post", payload=request.get_json())  # parse as JSON
         return "OK", 200
 
     else: # GET request
-        chain_and_attempts = generate_closed_chain(N, shift=True)
-        chain = chain_and_attempts['chain']
-        print(chain_and_attempts['attempts'])
-        payload = chain_to_JSON(chain)
-        return jsonify(payload)
+        chain, attempts, payload = CHAIN_POOL.start().get()
+        mimetype = request.accept_mimetypes.best_match(CHAIN_MIMETYPES, default=CHAIN_MIMETYPES[0])
+        emit("chain_served", attempts=attempts, mimetype=mimetype)
+        if mimetype == CHAIN_MIMETYPES[0]:
+            return compress_response(jsonify(payload))
+        return compress_response(Response(chain_to_bytes(chain, mimetype), mimetype=mimetype))
+
+
+def compress_response(response):
+    """return response, gzip or deflate compressed if the client accepts either."""
+    response.vary.add("Accept")
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(["gzip", "deflate"])
+    data = response.get_data()
+    if encoding is None or len(data) < MIN_COMPRESS_SIZE:
+        return response
+    response.set_data(gzip.compress(data) if encoding == "gzip" else zlib.compress(data))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+@app.route("/chains", methods=["GET", "POST"])
+def chains():
+    """return a stream of the classification of many chains, one record per chain.
+
+    GET generates the chains: count of them with num_nodes nodes each (an even
+    number), drawn from seed if given, and shift as in generate_closed_chain.
+    POST classifies uploaded chains instead, each a list of vertices on the
+    body-centered lattice, closed by repeating the first vertex as
+    generate_closed_chain does. They come either as json {"chains": [...]} or,
+    with Content-Type application/x-ndjson, as one json chain per line.
+
+    Every record holds the index of the chain, its knot determinant
+    (alex_poly), number of crossings, number of attempts (null for uploads)
+    and the classifier stage that settled it. They stream back as they are
+    computed, as NDJSON by default or as SUMMARY_DTYPE binary records if
+    Accept asks for SUMMARY_MIMETYPE.
+    """
+    try:
+        if request.method == "POST":
+            records = upload_source(parse_uploaded_chains())
+            seed = None
+        else:
+            num_nodes = request.args.get("num_nodes", N, type=int)
+            count = request.args.get("count", 1, type=int)
+            seed = request.args.get("seed", type=int)
+            shift = request.args.get("shift", 1, type=int) != 0
+            if num_nodes % 2 or not 4 <= num_nodes <= MAX_NODES:
+                raise ValueError("num_nodes must be even, between 4 and {}".format(MAX_NODES))
+            if not 0 <= count <= MAX_CHAINS_PER_REQUEST:
+                raise ValueError("count must be between 0 and {}".format(MAX_CHAINS_PER_REQUEST))
+            seed = np.random.SeedSequence(seed).entropy
+            records = chain_source(num_nodes, range(count), shift, seed)
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    summaries = summary_stage(invariant_stage(crossing_stage(projection_stage(records))))
+    mimetype = request.accept_mimetypes.best_match([NDJSON_MIMETYPE, SUMMARY_MIMETYPE],
+                                                   default=NDJSON_MIMETYPE)
+
+    def chunks():
+        chunk = []
+        for summary in summaries:
+            chunk.append(summary)
+            if len(chunk) == RESULTS_PER_CHUNK:
+                yield encode_summaries(chunk, mimetype)
+                chunk = []
+        if chunk:
+            yield encode_summaries(chunk, mimetype)
+
+    response = Response(stream_with_context(chunks()), mimetype=mimetype)
+    if seed is not None:
+        response.headers["X-Seed-Entropy"] = str(seed)
+    return response
+
+
+def parse_uploaded_chains():
+    """return list of the chains in the body of a POST to /chains, see chains.
+
+    Raises ValueError, naming the offending chain (or line of NDJSON), if any
+    of them is not a closed self-avoiding chain on the lattice.
+    """
+    if request.mimetype == NDJSON_MIMETYPE:
+        uploaded = []
+        for i, line in enumerate(request.get_data(as_text=True).splitlines()):
+            if not line.strip():
+                continue
+            try:
+                uploaded.append(json.loads(line))
+            except ValueError as error:
+                raise ValueError("line {} is not valid json: {}".format(i, error))
+    else:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get("chains"), list):
+            raise ValueError('expected a json object {"chains": [...]}')
+        uploaded = body["chains"]
+    if len(uploaded) > MAX_CHAINS_PER_REQUEST:
+        raise ValueError("at most {} chains per request".format(MAX_CHAINS_PER_REQUEST))
+
+    chains = []
+    for i, chain in enumerate(uploaded):
+        try:
+            chain = np.array(chain, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("chain {} is not an array of numbers".format(i))
+        if chain.ndim != 2 or chain.shape[1] != 3 or not 5 <= chain.shape[0] <= MAX_NODES + 1:
+            raise ValueError("chain {} must have between 5 and {} vertices of 3 coordinates"
+                             .format(i, MAX_NODES + 1))
+        if not np.all(np.abs(np.diff(chain, axis=0)) == 1):
+            raise ValueError("chain {} does not step along the lattice directions".format(i))
+        if not np.array_equal(chain[0], chain[-1]):
+            raise ValueError("chain {} is not closed, its last vertex must repeat its first".format(i))
+        if np.unique(chain[:-1], axis=0).shape[0] != chain.shape[0] - 1:
+            raise ValueError("chain {} is not self-avoiding, it visits a vertex twice".format(i))
+        chains.append(chain)
+    return chains
+
+
+def encode_summaries(summaries, mimetype):
+    """return bytes of a chunk of summary_stage dicts in mimetype."""
+    if mimetype == SUMMARY_MIMETYPE:
+        return summaries_to_bytes(summaries)
+    return "".join(json.dumps(summary) + "\n" for summary in summaries).encode()
 
 
 @app.route("/plot.png", methods=["GET"])
 def plot_png():
-    fig = create_figure()
-    output = io.BytesIO()
-    FigureCanvas(fig).print_png(output)
-    return Response(output.getvalue(), mimetype='image/png')
+    """return png of the histogram of attempts over the samples in SAMPLE_STORE.
 
+    The samples grow in the background, so every load shows the latest
+    published snapshot. A snapshot is rendered once: the png is cached, and
+    tagged, by (N, bins, number of samples), so a repeat load costs a dict
+    lookup, or nothing at all when the browser revalidates with If-None-Match.
+    bins must be between 1 and MAX_HISTOGRAM_BINS, else the answer is 400.
+    """
+    bins = request.args.get("bins", HISTOGRAM_BINS, type=int)
+    if not 1 <= bins <= MAX_HISTOGRAM_BINS:
+        return jsonify(error="bins must be between 1 and {}".format(MAX_HISTOGRAM_BINS)), 400
+    snapshot = SAMPLE_STORE.start().latest()
+    key = (N, bins, snapshot.num_samples)
+    with PLOT_CACHE_LOCK:
+        png = PLOT_CACHE.get(key)
+        if png is not None:
+            PLOT_CACHE.move_to_end(key)
+    if png is None:
+        output = io.BytesIO()
+        FigureCanvas(create_figure(snapshot, bins)).print_png(output)
+        png = output.getvalue()
+        with PLOT_CACHE_LOCK:
+            PLOT_CACHE[key] = png
+            while len(PLOT_CACHE) > PLOT_CACHE_SIZE:
+                PLOT_CACHE.popitem(last=False)
+    response = Response(png, mimetype='image/png')
+    response.set_etag("{}-{}-{}".format(*key))
+    return response.make_conditional(request)
 
-def create_figure():
-    raw_data = basic_monte_carlo_sim(N, NUM_CHAINS, table=False, shift=True)
-    hist, bin_edges = np.histogram(raw_data[:,1], 50, density=True)
+
+def create_figure(snapshot, bins=HISTOGRAM_BINS):
+    hist, bin_edges = snapshot.histogram(bins)
     fig = Figure()
     axis = fig.add_subplot(111)
     axis.bar(bin_edges[:-1], hist, width=np.diff(bin_edges), edgecolor="black",
              align="edge")
+    axis.set_title("N = {}, {} chains".format(snapshot.num_nodes, snapshot.num_samples))
     return fig
 
 
+@app.route("/jobs", methods=["GET", "POST"])
+def jobs():
+    """return json of every job for GET, submit a job for POST.
+
+    The body of a POST is {"kind": "sweep", "params": {...}}, see
+    check_sweep_params for the params; the answer is 202 with the id of the
+    queued job, whose progress is then at /jobs/<id>.
+    """
+    manager = JOB_MANAGER.start()
+    if request.method == "GET":
+        return jsonify(jobs=manager.store.list())
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("params", {}), dict):
+        return jsonify(error="expected json {\"kind\": ..., \"params\": {...}}"), 400
+    try:
+        job_id = manager.submit(body.get("kind", "sweep"), body.get("params", {}))
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    return jsonify(id=job_id, status="queued"), 202, {"Location": "/jobs/" + job_id}
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """return json of the status and progress of job job_id, without its result."""
+    job = JOB_MANAGER.start().store.get(job_id)
+    if job is None:
+        return jsonify(error="no job {}".format(job_id)), 404
+    del job["result"]
+    return jsonify(job)
+
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def job_cancel(job_id):
+    """return json of the job, cancelled; 409 if it had already finished."""
+    manager = JOB_MANAGER.start()
+    if manager.store.get(job_id) is None:
+        return jsonify(error="no job {}".format(job_id)), 404
+    if not manager.cancel(job_id):
+        return jsonify(error="job {} has already finished".format(job_id)), 409
+    return jsonify(id=job_id, status="cancelled")
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    """return json of the result of job job_id; 409 until it is done."""
+    job = JOB_MANAGER.start().store.get(job_id)
+    if job is None:
+        return jsonify(error="no job {}".format(job_id)), 404
+    if job["status"] != "done":
+        return jsonify(error="job {} is {}".format(job_id, job["status"])), 409
+    return jsonify(id=job_id, result=job["result"])
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_json():
+    """return json of the stage timings and counts recorded so far, see app.metrics."""
+    return jsonify(dict(metrics.snapshot(), chain_pool=CHAIN_POOL.stats(),
+                        samples=SAMPLE_STORE.latest().num_samples))
+
+
 @app.route("/")
 @app.route("/index")
 def index():
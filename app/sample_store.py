@@ -0,0 +1,123 @@
+import sys
+import threading
+
+import numpy as np
+
+from .metrics import emit
+from .pipeline import read_results, stream_monte_carlo
+
+# Monte carlo samples of one N, accumulated in the background for the plots.
+#
+# A producer thread runs stream_monte_carlo and folds every chain into a
+# bincount of attempts and a knot count, so a histogram of any number of bins
+# comes straight from the counts, without the samples themselves. Every
+# publish_every samples the counts are published as an immutable snapshot;
+# readers only ever see snapshots, so a plot of a given snapshot is the same
+# every time and can be cached by its sample count.
+#
+# With a checkpoint directory the samples outlive the process: a new store on
+# the same directory starts from the samples already there.
+DEFAULT_PUBLISH_EVERY = 100
+DEFAULT_MAX_SAMPLES = 20000
+
+
+class SampleSnapshot:
+    """published state of a SampleStore: attempt counts, knots and sample count."""
+
+    def __init__(self, num_nodes, attempt_counts, knots):
+        self.num_nodes = num_nodes
+        self.attempt_counts = attempt_counts
+        self.knots = knots
+        self.num_samples = int(attempt_counts.sum())
+
+    def histogram(self, bins=50):
+        """return (hist, bin_edges), as np.histogram(attempts, bins, density=True) would."""
+        attempts = np.nonzero(self.attempt_counts)[0]
+        if attempts.shape[0] == 0:
+            return np.zeros(bins), np.linspace(0.0, 1.0, bins + 1)
+        return np.histogram(attempts, bins, weights=self.attempt_counts[attempts], density=True)
+
+
+class SampleStore:
+    """samples of the attempts and knots of chains of num_nodes nodes, growing in the background.
+
+    arguments:
+    num_nodes - int - number of nodes of every chain
+    shift - boolean - as in generate_closed_chain
+    checkpoint_dir - str or Path - where to keep the samples, see stream_monte_carlo
+    max_samples - int - the producer stops once the store holds this many
+    publish_every - int - samples between published snapshots
+    """
+
+    def __init__(self, num_nodes, shift=True, checkpoint_dir=None,
+                 max_samples=DEFAULT_MAX_SAMPLES, publish_every=DEFAULT_PUBLISH_EVERY):
+        self.num_nodes = num_nodes
+        self.shift = shift
+        self.checkpoint_dir = checkpoint_dir
+        self.max_samples = max_samples
+        self.publish_every = publish_every
+        self.attempt_counts = np.zeros(1, dtype=np.int64)
+        self.knots = 0
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.producer = None
+        self.snapshot = SampleSnapshot(num_nodes, self.attempt_counts.copy(), 0)
+
+    def add(self, is_knotted, attempts):
+        """return None. Fold one sample into the counts, publishing when due."""
+        if attempts >= self.attempt_counts.shape[0]:
+            self.attempt_counts = np.append(self.attempt_counts,
+                                            np.zeros(attempts + 1 - self.attempt_counts.shape[0],
+                                                     dtype=np.int64))
+        self.attempt_counts[attempts] += 1
+        self.knots += bool(is_knotted)
+        if self.attempt_counts.sum() % self.publish_every == 0:
+            self.publish()
+
+    def publish(self):
+        """return None. Make the current counts visible to readers."""
+        snapshot = SampleSnapshot(self.num_nodes, self.attempt_counts.copy(), self.knots)
+        with self.lock:
+            self.snapshot = snapshot
+        emit("samples_published", num_nodes=self.num_nodes, num_samples=snapshot.num_samples)
+
+    def latest(self):
+        """return the latest published SampleSnapshot."""
+        with self.lock:
+            return self.snapshot
+
+    def start(self):
+        """return self. Start the producer thread, unless it is running already."""
+        with self.lock:
+            if self.producer is not None:
+                return self
+            self.producer = threading.Thread(target=self.produce, name="sample-store", daemon=True)
+        self.producer.start()
+        return self
+
+    def stop(self, timeout=None):
+        """return None. Stop the producer once its current chain is done."""
+        self.stopping.set()
+        if self.producer is not None:
+            self.producer.join(timeout)
+
+    def produce(self):
+        if self.checkpoint_dir is not None:
+            try:
+                for is_knotted, attempts in read_results(self.checkpoint_dir):
+                    self.add(is_knotted, int(attempts))
+            except FileNotFoundError: # nothing saved yet
+                pass
+            self.publish()
+        if self.attempt_counts.sum() >= self.max_samples:
+            return
+        stream = stream_monte_carlo(self.num_nodes, sys.maxsize, shift=self.shift,
+                                    checkpoint_dir=self.checkpoint_dir)
+        try:
+            for (_, alex_poly, attempts, _), _ in stream:
+                self.add(alex_poly != 1, attempts)
+                if self.stopping.is_set() or self.attempt_counts.sum() >= self.max_samples:
+                    break
+        finally:
+            stream.close()
+            self.publish()
@@ -24,23 +24,21 @@ function init() {
     var group = new THREE.Object3D();
     var chain_geometry = new THREE.Geometry();
 
-    // obtain the actual chain data from python
-    fetch('/data_helper')
+    // obtain the actual chain data from python, as a raw float32 vertex buffer
+    // (see chain_to_bytes) rather than json
+    fetch('/data_helper', { headers: { 'Accept': 'application/x-chain-float32' } })
         .then(function (response) {
-            return response.json();
-        }).then(function (json) {
+            return response.arrayBuffer();
+        }).then(function (buffer) {
+            var vertexArray = new Float32Array(buffer);
             // Report that we got the payload...
-            console.log('GET response JSON:');
-            console.log(json);
-            // Now do something with it
-            var obj = JSON.parse(json);
-            var vertexArray = obj.vertices;
+            console.log('GET response: ' + vertexArray.length / 3 + ' vertices');
 
-            vertexArray.forEach((vertex) => {
+            for (var i = 0; i < vertexArray.length; i += 3) {
                 chain_geometry.vertices.push(
-                    new THREE.Vector3(vertex[0], vertex[1], vertex[2])
+                    new THREE.Vector3(vertexArray[i], vertexArray[i + 1], vertexArray[i + 2])
                 );
-            });
+            }
 
             // now create the mesh
             for (var j = 0; j < chain_geometry.vertices.length - 1; ++j) {
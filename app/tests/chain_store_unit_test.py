@@ -0,0 +1,50 @@
+import json
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ..chain_store import append_chains, iter_chains, open_chains
+
+# TODO: change from absolute path (rel to project root) to variable
+TEST_CASE_N_18 = "app/tests/valid_test_knots_N_18.json"
+
+def chain_store_unit_test():
+    """Return None. Round trip the N = 18 test knots through a chain store"""
+    with open(TEST_CASE_N_18) as ifile:
+        print("Loading test data from file {}...".format(TEST_CASE_N_18))
+        test_chains = np.array(json.load(ifile)["tests"], dtype=np.float64)
+
+    with tempfile.TemporaryDirectory() as store:
+        # two chunks, to check that appending keeps the earlier chains intact
+        half = test_chains.shape[0] // 2
+        append_chains(store, test_chains[:half])
+        append_chains(store, test_chains[half:])
+        loaded = np.concatenate([chains for chains, _ in iter_chains(store, batch_size=50)])
+
+    agree = np.array_equal(loaded, test_chains)
+    print("Round tripped {} chains through the chain store ({}).".format(
+          loaded.shape[0], "agree" if agree else "DISAGREE"))
+
+
+def chain_store_concurrent_unit_test(num_writers=4):
+    """Return None. Append the N = 18 test knots from several processes at
+    once, every index record must still point at its own chain"""
+    with open(TEST_CASE_N_18) as ifile:
+        print("Loading test data from file {}...".format(TEST_CASE_N_18))
+        test_chains = np.array(json.load(ifile)["tests"], dtype=np.float64)
+
+    with tempfile.TemporaryDirectory() as store:
+        # one chain per append, tagged by its attempts, so writes interleave
+        with ProcessPoolExecutor(num_writers) as executor:
+            list(executor.map(append_chains, [store] * test_chains.shape[0],
+                              test_chains[:, np.newaxis], range(test_chains.shape[0])))
+        _, index = open_chains(store)
+        offsets = np.sort(index['offset'])
+        loaded, attempts = zip(*iter_chains(store, batch_size=50))
+        loaded, attempts = np.concatenate(loaded), np.concatenate(attempts)
+
+    agree = np.array_equal(offsets, 18 * np.arange(test_chains.shape[0])) and \
+            np.array_equal(loaded, test_chains[attempts.astype(np.int64)])
+    print("Appended {} chains from {} processes ({}).".format(loaded.shape[0], num_writers,
+          "agree" if agree else "DISAGREE"))
@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+from collections import Counter
+
+import numpy as np
+
+from ..classification_cache import ClassificationCache
+from ..private.utilities import lattice_symmetry_group, least_rotation
+
+# TODO: change from absolute path (rel to project root) to variable
+TEST_CASE_N_18 = "app/tests/valid_test_knots_N_18.json"
+
+def classification_cache_unit_test():
+    """Return None. Copies of the N = 18 test knots must all hit the cache"""
+    with open(TEST_CASE_N_18) as ifile:
+        print("Loading test data from file {}...".format(TEST_CASE_N_18))
+        test_chains = np.array(json.load(ifile)["tests"], dtype=np.float64)
+
+    symmetries = lattice_symmetry_group()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.sqlite")
+        cache = ClassificationCache(path=path)
+        stats = Counter()
+        results = [cache.classify(chain, stats) for chain in test_chains]
+        print("Classified {} chains, {} cache hits.".format(len(results), stats["cache_hits"]))
+
+        # moved, reflected, restarted and reversed copies, through a fresh
+        # memory tier so that they can only hit the disk tier
+        cache = ClassificationCache(path=path)
+        stats = Counter()
+        agree = True
+        for i, chain in enumerate(test_chains):
+            copy = np.roll(chain[:-1], i, axis=0) @ symmetries[i % len(symmetries)].T + i
+            copy = np.concatenate((copy, copy[:1]))[::-1]
+            agree &= cache.classify(copy, stats) == results[i]
+        cache.close()
+    print("Copies: {} of {} hit the cache ({}).".format(stats["cache_hits"],
+          len(test_chains), "agree" if agree else "DISAGREE"))
+
+
+def least_rotation_unit_test():
+    """Return None. Check least_rotation against trying every rotation"""
+    rng = np.random.RandomState(0)
+    num_passed, num_sequences = 0, 1000
+    for _ in range(num_sequences):
+        # few distinct elements, so that repeats and ties are common
+        sequence = rng.randint(3, size=rng.randint(1, 16)).tolist()
+        k = least_rotation(sequence)
+        num_passed += sequence[k:] + sequence[:k] == min(sequence[i:] + sequence[:i]
+                                                         for i in range(len(sequence)))
+    print("Passed {} of {} sequences.".format(num_passed, num_sequences))
@@ -0,0 +1,85 @@
+import json
+from collections import Counter
+
+import numpy as np
+
+from ..alexander import (CLASSIFIER_STAGES, alexander_matrix_pencil, classify_chain,
+                         evaluate_alexander_polynomial, format_classifier_stats,
+                         underpass_info_of_chain)
+from ..generate_chain import generate_closed_chains_batch
+from ..pipeline import MAX_NODES
+
+# TODO: change from absolute path (rel to project root) to variable
+TEST_CASE_KNOTS = "app/tests/valid_test_knots_N_18.json"
+TEST_CASE_UNKNOTS = ["app/tests/valid_test_chains_N8.json",
+                     "app/tests/valid_test_chains_N30.json",
+                     "app/tests/valid_test_chains_N90.json",
+                     "app/tests/valid_test_chains_N140.json"]
+# long chains, with segment indices past 255, and random chains as long as
+# /chains and the jobs serve
+LONG_TEST_CASE_KNOTS = "app/tests/valid_test_knots_N_418.json"
+LONG_TEST_CASE_UNKNOTS = "app/tests/valid_test_chains_N408.json"
+RANDOM_N = MAX_NODES
+RANDOM_CHAINS = 40
+
+# |Delta(-1)| of the trefoil and of the unknot
+TREFOIL_DETERMINANT = 3
+UNKNOT_DETERMINANT = 1
+
+def classify_test_cases(test_cases, expected):
+    """return (num_passed, num_chains, stats) of classify_chain over the chains in test_cases"""
+    num_passed, num_chains, stats = 0, 0, Counter()
+    for test_case in test_cases:
+        with open(test_case) as ifile:
+            print("Loading test data from file {}...".format(test_case))
+            test_chains = json.load(ifile)["tests"]
+        for i, chain in enumerate(test_chains):
+            alex_poly, stage = classify_chain(np.array(chain, dtype=np.float64), stats)
+            num_passed += alex_poly == expected
+            if alex_poly != expected:
+                print("{} chain {}: {} at stage {} (FAILED)".format(test_case, i, alex_poly, stage))
+        num_chains += len(test_chains)
+    return num_passed, num_chains, stats
+
+
+def classify_chain_unit_test():
+    """Return None. The test knots are trefoils and the test chains unknots"""
+    for test_cases, expected in (([TEST_CASE_KNOTS], TREFOIL_DETERMINANT),
+                                 (TEST_CASE_UNKNOTS, UNKNOT_DETERMINANT)):
+        num_passed, num_chains, stats = classify_test_cases(test_cases, expected)
+        # every chain is settled by exactly one stage, and no early exit may
+        # settle a knot
+        counted = sum(stats[stage] for stage in CLASSIFIER_STAGES) == num_chains and \
+                  (expected == UNKNOT_DETERMINANT or stats["determinant"] == num_chains)
+        print("Passed {} of {} chains, stages {} ({}).".format(num_passed, num_chains,
+              format_classifier_stats(stats), "agree" if counted else "DISAGREE"))
+
+
+def classify_chain_long_unit_test():
+    """Return None. On long chains, the staged classifier with and without
+    reduction must agree with the determinant of the full alexander matrix,
+    and with the knot type where it is known"""
+    with open(LONG_TEST_CASE_KNOTS) as ifile:
+        knots = json.load(ifile)["tests"]
+    with open(LONG_TEST_CASE_UNKNOTS) as ifile:
+        unknots = json.load(ifile)["tests"]
+    random_chains = generate_closed_chains_batch(RANDOM_N, RANDOM_CHAINS,
+                                                 rng=np.random.RandomState(0))['chain']
+    test_chains = [(chain, TREFOIL_DETERMINANT) for chain in knots] + \
+                  [(chain, UNKNOT_DETERMINANT) for chain in unknots] + \
+                  [(chain, None) for chain in random_chains]
+
+    num_passed, stats = 0, Counter()
+    for i, (chain, expected) in enumerate(test_chains):
+        chain = np.array(chain, dtype=np.float64)
+        A0, A1 = alexander_matrix_pencil(underpass_info_of_chain(chain))
+        full = evaluate_alexander_polynomial(A0 - A1) # t = -1, no early exits
+        staged, stage = classify_chain(chain, stats)
+        reduced, reduced_stage = classify_chain(chain, reduce=True)
+        passed = staged == reduced == full and (expected is None or full == expected)
+        num_passed += passed
+        if not passed:
+            print("chain {}: full {}, staged {} at stage {}, reduced {} at stage {} (FAILED)".format(
+                  i, full, staged, stage, reduced, reduced_stage))
+    print("Passed {} of {} long chains, stages {}.".format(num_passed, len(test_chains),
+          format_classifier_stats(stats)))
@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+
+from ..alexander import (alexander_matrix_pencil, evaluate_alexander_polynomial,
+                         underpass_info_of_chain)
+from ..private.utilities import collect_all_intersections
+from ..projection import find_reg_project
+from .intersect_unit_test import in_knot_order
+
+# TODO: change from absolute path (rel to project root) to variable
+TEST_CASES = ["app/tests/valid_test_chains_N8.json",
+              "app/tests/valid_test_chains_N30.json",
+              "app/tests/valid_test_chains_N90.json",
+              "app/tests/valid_test_chains_N140.json"]
+# long chains, where the grid finder is meant to be used, and their |Delta(-1)|
+LONG_TEST_CASES = [("app/tests/valid_test_knots_N_418.json", 3),
+                   ("app/tests/valid_test_chains_N408.json", 1)]
+
+def collect_all_intersections_unit_test():
+    """Return None. Check the grid crossing finder against the brute force one"""
+    for test_case in TEST_CASES:
+        with open(test_case) as ifile:
+            print("Loading test data from file {}...".format(test_case))
+            test_chains = json.load(ifile)["tests"]
+
+        for i, chain in enumerate(test_chains):
+            proj = find_reg_project(np.array(chain, dtype=np.float64))
+            brute = collect_all_intersections(proj, method="brute")
+            grid = collect_all_intersections(proj, method="grid")
+            agree = brute.shape == grid.shape and \
+                    np.array_equal(brute["indices"], grid["indices"]) and \
+                    np.array_equal(brute["coords"], grid["coords"]) and \
+                    np.array_equal(brute["order_param"], grid["order_param"])
+            print("chain {}: {} intersections ({})".format(i, brute.shape[0],
+                  "agree" if agree else "DISAGREE"))
+
+        print("Finished checking {} chains from {}.".format(len(test_chains), test_case))
+
+
+def collect_all_intersections_long_unit_test():
+    """Return None. Check the grid crossing finder on long chains, by the order
+    of its rows and by the determinant they lead to"""
+    for test_case, expected in LONG_TEST_CASES:
+        with open(test_case) as ifile:
+            print("Loading test data from file {}...".format(test_case))
+            test_chains = json.load(ifile)["tests"]
+
+        num_passed = 0
+        for i, chain in enumerate(test_chains):
+            chain = np.array(chain, dtype=np.float64)
+            grid = collect_all_intersections(find_reg_project(chain), method="grid")
+            A0, A1 = alexander_matrix_pencil(underpass_info_of_chain(chain, method="grid"))
+            knot_determinant = evaluate_alexander_polynomial(A0 - A1) # t = -1
+            passed = in_knot_order(grid) and knot_determinant == expected
+            num_passed += passed
+            if not passed:
+                print("chain {}: {} intersections, determinant {} (FAILED)".format(i,
+                      grid.shape[0], knot_determinant))
+        print("Passed {} of {} chains of {} nodes.".format(num_passed, len(test_chains),
+              len(test_chains[0]) - 1))
@@ -1,6 +1,17 @@
+import json
+
 import numpy as np
 
-from ..private.utilities import find_intersection_2D
+from ..private.utilities import (collect_all_intersections,
+                                 find_intersection_2D,
+                                 find_intersection_2D_vec,
+                                 find_intersections_2D_batch)
+from ..projection import find_reg_project
+
+# TODO: change from absolute path (rel to project root) to variable
+TEST_CASES = ["app/tests/valid_test_knots_N_18.json",
+              "app/tests/valid_test_chains_N140.json",
+              "app/tests/valid_test_knots_N_418.json"]
 
 
 def intersect_unit_test():
@@ -17,3 +28,51 @@ def intersect_unit_test():
     else:
         print("intersection at ({x}, {y})".format(x=intersection[0], 
               y=intersection[1]))
+
+
+def intersect_batch_unit_test():
+    """Return None. Test find_intersections_2D_batch against find_intersection_2D_vec"""
+    segments = np.array([[[0., 0.], [2., 2.], [0., 2.], [2., 0.]],   # crossing
+                         [[0., 0.], [1., 1.], [0., 1.], [1., 2.]],   # parallel
+                         [[0., 0.], [1., 0.], [2., -1.], [2., 1.]],  # out of segment
+                         [[0., 0.], [4., 1.], [1., -1.], [2., 3.]]]) # crossing
+
+    coords, order_param, found = find_intersections_2D_batch(
+        segments[:,0], segments[:,1], segments[:,2], segments[:,3])
+
+    for i, (p1, p2, p3, p4) in enumerate(segments):
+        intersection = find_intersection_2D_vec(p1, p2, p3, p4)
+        if intersection is None:
+            status = "agree" if not found[i] else "DISAGREE"
+            print("pair {}: no intersection ({})".format(i, status))
+        else:
+            agree = found[i] and np.allclose(intersection['coords'][0], coords[i]) \
+                    and np.isclose(intersection['order_param'][0], order_param[i])
+            print("pair {}: intersection at {} with order param {} ({})".format(
+                  i, coords[i], order_param[i], "agree" if agree else "DISAGREE"))
+
+
+def in_knot_order(intersections):
+    """return bool, whether the rows of intersections are met in this order walking along the knot"""
+    k = intersections["indices"][:,0].astype(np.int64)
+    order_param = intersections["order_param"]
+    return bool(np.all((np.diff(k) > 0) | ((np.diff(k) == 0) & (np.diff(order_param) > 0))))
+
+
+def collect_all_intersections_order_unit_test():
+    """Return None. Check that every crossing is listed from both segments, in knot order"""
+    for test_case in TEST_CASES:
+        with open(test_case) as ifile:
+            print("Loading test data from file {}...".format(test_case))
+            test_chains = json.load(ifile)["tests"]
+
+        num_passed = 0
+        for i, chain in enumerate(test_chains):
+            intersections = collect_all_intersections(find_reg_project(np.array(chain, dtype=np.float64)))
+            indices = intersections["indices"][:, [0, 2]].tolist()
+            passed = in_knot_order(intersections) and \
+                     sorted(indices) == sorted([j, k] for k, j in indices)
+            num_passed += passed
+            if not passed:
+                print("chain {}: {} intersections out of order (FAILED)".format(i, intersections.shape[0]))
+        print("Passed {} of {} chains.".format(num_passed, len(test_chains)))
@@ -0,0 +1,32 @@
+import os
+import tempfile
+
+import numpy as np
+
+from ..pipeline import read_results, stream_monte_carlo
+
+NUM_NODES = 30
+NUM_CHAINS = 200
+SEED = 2021
+
+def pipeline_unit_test():
+    """Return None. An interrupted and resumed run must match an unbroken one"""
+    unbroken = [result for result, _ in stream_monte_carlo(NUM_NODES, NUM_CHAINS, seed=SEED)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint_dir = os.path.join(directory, "run")
+        stream = stream_monte_carlo(NUM_NODES, NUM_CHAINS, seed=SEED,
+                                    checkpoint_dir=checkpoint_dir, checkpoint_every=25)
+        for i, _ in zip(range(NUM_CHAINS // 3), stream):
+            pass
+        stream.close() # as if interrupted
+        print("Interrupted after {} chains.".format(len(read_results(checkpoint_dir))))
+
+        resumed = [result for result, _ in stream_monte_carlo(NUM_NODES, NUM_CHAINS,
+                                                              checkpoint_dir=checkpoint_dir)]
+        raw_data = read_results(checkpoint_dir)
+
+    expected = np.array([[alex_poly != 1, attempts] for _, alex_poly, attempts, _ in unbroken])
+    agree = resumed == unbroken[-len(resumed):] and np.array_equal(raw_data, expected)
+    print("Resumed for the remaining {} chains ({}).".format(len(resumed),
+          "agree" if agree else "DISAGREE"))
@@ -0,0 +1,52 @@
+from collections import Counter
+
+import numpy as np
+
+from ..generate_chain import generate_closed_chain
+
+N = 16
+NUM_CHAINS = 100
+NUM_IT = 1000
+# the polygons are taken to have mixed if running LONG_RUN times as many
+# moves does not move the mean by more than MAX_SIGMAS standard errors
+LONG_RUN = 5
+MAX_SIGMAS = 3
+
+def radius_of_gyration_squared(chain):
+    """return the squared radius of gyration of a closed chain (with chain[-1] == chain[0])"""
+    nodes = chain[:-1]
+    return np.mean(np.sum((nodes - nodes.mean(axis=0))**2, axis=1))
+
+
+def sample_radii(seed, stats=None, **kwargs):
+    """return (mean, standard error) of the squared radius of gyration of
+    NUM_CHAINS closed chains of generate_closed_chain(N, **kwargs)"""
+    rng = np.random.RandomState(seed)
+    radii = [radius_of_gyration_squared(generate_closed_chain(N, rng=rng, stats=stats,
+                                                              **kwargs)['chain'])
+             for _ in range(NUM_CHAINS)]
+    return np.mean(radii), np.std(radii) / np.sqrt(NUM_CHAINS)
+
+
+def polygon_sampler_unit_test():
+    """Return None. Compares the polygon sampler against a longer run of itself
+    and against the worm sampler"""
+    stats = Counter()
+    worm_mean, worm_error = sample_radii(1)
+    polygon_mean, polygon_error = sample_radii(2, stats, polygon=True, num_it=NUM_IT)
+    long_mean, long_error = sample_radii(3, polygon=True, num_it=LONG_RUN*NUM_IT)
+
+    print("Accepted {} of {} polygon moves ({:.1%}).".format(
+          stats["polygon_moves_accepted"], stats["polygon_moves"],
+          stats["polygon_moves_accepted"] / stats["polygon_moves"]))
+    print("Mean Rg^2 at N={}: worm {:.3f} +- {:.3f}, polygon {:.3f} +- {:.3f} ({} moves), "
+          "polygon {:.3f} +- {:.3f} ({} moves).".format(N, worm_mean, worm_error,
+          polygon_mean, polygon_error, NUM_IT, long_mean, long_error, LONG_RUN*NUM_IT))
+
+    mixed = abs(polygon_mean - long_mean) <= MAX_SIGMAS * np.hypot(polygon_error, long_error)
+    print("Polygon runs of {} and {} moves {}.".format(NUM_IT, LONG_RUN*NUM_IT,
+          "agree" if mixed else "DISAGREE"))
+    # the worm is biased towards closing, which is what the polygon sampler is
+    # there to measure, so the difference is reported rather than checked
+    print("Worm differs from the polygon sampler by {:.1f} standard errors.".format(
+          (worm_mean - polygon_mean) / np.hypot(worm_error, polygon_error)))
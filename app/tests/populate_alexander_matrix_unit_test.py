@@ -2,13 +2,24 @@ import json
 
 import numpy as np
 
-from ..alexander import (evaluate_alexander_polynomial,
-                         populate_alexander_matrix)
-from ..private.utilities import pre_alexander_compile, rot_saw_xy
-from ..projection import find_reg_project
+from ..alexander import (alexander_matrix_pencil, alexander_polynomial,
+                         evaluate_alexander_polynomial, is_alexander_polynomial,
+                         populate_alexander_matrix, underpass_info_of_chain)
+from ..generate_chain import generate_closed_chains_batch
 
 # TODO: change from absolute path (rel to project root) to variable
-TEST_CASE_N_18 = "app/tests/test_knots_N_18.json"
+TEST_CASE_N_18 = "app/tests/valid_test_knots_N_18.json"
+# chains long enough for segment indices past 255, trefoils and unknots
+TEST_CASE_N_418 = "app/tests/valid_test_knots_N_418.json"
+TEST_CASE_N_408 = "app/tests/valid_test_chains_N408.json"
+
+# the trefoil, as alexander_polynomial normalizes it, and |Delta(-1)|
+TREFOIL_POLYNOMIAL = (1, -1, 1)
+TREFOIL_DETERMINANT = 3
+UNKNOT_DETERMINANT = 1
+# random chains past 256 nodes, checked for the invariants of every knot
+RANDOM_N = 300
+RANDOM_CHAINS = 40
 
 def populate_alexander_matrix_unit_test():
     with open(TEST_CASE_N_18) as ifile:
@@ -21,12 +32,81 @@ def populate_alexander_matrix_unit_test():
         print("Printing {} Alexander Polynomials from loaded test data.".format(num_chains))
 
         for chain in test_chains:
-            alex_mat = populate_alexander_matrix(rot_saw_xy(chain),
-                                                      find_reg_project(chain),
-                                                      -1)
+            alex_mat = populate_alexander_matrix(np.array(chain, dtype=np.float64), -1)
             alex_poly = evaluate_alexander_polynomial(alex_mat)
             if alex_poly == 1:
                 print(chain, end='\n')
                 print(alex_mat, end='\n\n')
 
         print("Finished Printing {} Alexander Polynomials from loaded test data.".format(num_chains))
+
+
+def alexander_polynomial_unit_test():
+    """Return None. Every N = 18 test knot is a trefoil, check its polynomial and determinant"""
+    with open(TEST_CASE_N_18) as ifile:
+        print("Loading test data from file {}...".format(TEST_CASE_N_18))
+        test_chains = json.load(ifile)["tests"]
+
+    num_passed = 0
+    for i, chain in enumerate(test_chains):
+        underpass_info = underpass_info_of_chain(np.array(chain, dtype=np.float64))
+        A0, A1 = alexander_matrix_pencil(underpass_info)
+        knot_determinant = evaluate_alexander_polynomial(A0 - A1) # t = -1
+        alex_poly = alexander_polynomial(underpass_info)
+        passed = alex_poly == TREFOIL_POLYNOMIAL and knot_determinant == TREFOIL_DETERMINANT
+        num_passed += passed
+        if not passed:
+            print("knot {}: polynomial {}, determinant {} (FAILED)".format(i, alex_poly,
+                  knot_determinant))
+    print("Passed {} of {} knots.".format(num_passed, len(test_chains)))
+
+
+def long_chain_determinant_unit_test():
+    """Return None. The long test knots are trefoils and the long test chains unknots"""
+    for test_case, expected in ((TEST_CASE_N_418, TREFOIL_DETERMINANT),
+                                (TEST_CASE_N_408, UNKNOT_DETERMINANT)):
+        with open(test_case) as ifile:
+            print("Loading test data from file {}...".format(test_case))
+            test_chains = json.load(ifile)["tests"]
+
+        num_passed = 0
+        for i, chain in enumerate(test_chains):
+            A0, A1 = alexander_matrix_pencil(underpass_info_of_chain(np.array(chain, dtype=np.float64)))
+            knot_determinant = evaluate_alexander_polynomial(A0 - A1) # t = -1
+            num_passed += knot_determinant == expected
+            if knot_determinant != expected:
+                print("chain {}: determinant {} (FAILED)".format(i, knot_determinant))
+        print("Passed {} of {} chains of {} nodes.".format(num_passed, len(test_chains),
+              len(test_chains[0]) - 1))
+
+
+def alexander_polynomial_long_unit_test():
+    """Return None. Check the polynomials of long chains: the long test chains
+    against their knot types, random ones only against Delta(t) = Delta(1/t),
+    |Delta(1)| = 1 and |Delta(-1)| = the float determinant"""
+    with open(TEST_CASE_N_418) as ifile:
+        knots = json.load(ifile)["tests"]
+    with open(TEST_CASE_N_408) as ifile:
+        unknots = json.load(ifile)["tests"]
+    random_chains = generate_closed_chains_batch(RANDOM_N, RANDOM_CHAINS,
+                                                 rng=np.random.RandomState(0))['chain']
+    test_chains = [(chain, TREFOIL_POLYNOMIAL) for chain in knots] + \
+                  [(chain, (1,)) for chain in unknots] + \
+                  [(chain, None) for chain in random_chains]
+
+    num_passed = 0
+    for i, (chain, expected) in enumerate(test_chains):
+        underpass_info = underpass_info_of_chain(np.array(chain, dtype=np.float64))
+        A0, A1 = alexander_matrix_pencil(underpass_info)
+        knot_determinant = evaluate_alexander_polynomial(A0 - A1) # t = -1
+        alex_poly = alexander_polynomial(underpass_info)
+        passed = is_alexander_polynomial(alex_poly) and \
+                 abs(sum(c * (-1)**k for k, c in enumerate(alex_poly))) == knot_determinant and \
+                 (expected is None or alex_poly == expected)
+        num_passed += passed
+        if not passed:
+            print("chain {}: polynomial {}, determinant {} (FAILED)".format(i, alex_poly,
+                  knot_determinant))
+    print("Passed {} of {} chains of {} to {} nodes.".format(num_passed, len(test_chains),
+          min(len(chain) - 1 for chain, _ in test_chains),
+          max(len(chain) - 1 for chain, _ in test_chains)))
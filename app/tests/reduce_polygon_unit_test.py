@@ -0,0 +1,62 @@
+import json
+
+import numpy as np
+
+from ..alexander import alexander_polynomial, classify_chain, underpass_info_of_chain
+from ..private.utilities import reduce_polygon
+
+# TODO: change from absolute path (rel to project root) to variable
+TEST_CASE_KNOTS = "app/tests/valid_test_knots_N_18.json"
+TRIVIAL_CASES = ["app/tests/valid_test_chains_N30.json",
+                 "app/tests/valid_test_chains_N90.json",
+                 "app/tests/valid_test_chains_N140.json"]
+
+# fewest edges a trefoil can be made of
+TREFOIL_STICK_NUMBER = 6
+
+def reduce_polygon_unit_test():
+    """Return None. Reduce the test chains, knotted ones must keep enough vertices"""
+    with open(TEST_CASE_KNOTS) as ifile:
+        print("Loading test data from file {}...".format(TEST_CASE_KNOTS))
+        test_knots = json.load(ifile)["tests"]
+
+    num_passed = 0
+    for i, chain in enumerate(test_knots):
+        saw = np.array(chain, dtype=np.float64)
+        reduced = reduce_polygon(saw)
+        # a closed chain has one vertex more than edges, its first one repeated
+        passed = TREFOIL_STICK_NUMBER + 1 <= reduced.shape[0] <= saw.shape[0] and \
+                 np.array_equal(reduced[0], saw[0]) and np.array_equal(reduced[-1], saw[-1])
+        num_passed += passed
+        if not passed:
+            print("knot {}: reduced to {} vertices (FAILED)".format(i, reduced.shape[0]))
+    print("Passed {} of {} knots.".format(num_passed, len(test_knots)))
+
+    for test_case in TRIVIAL_CASES:
+        with open(test_case) as ifile:
+            test_chains = json.load(ifile)["tests"]
+        for i, chain in enumerate(test_chains):
+            saw = np.array(chain, dtype=np.float64)
+            print("{} chain {}: {} -> {} vertices".format(test_case, i, saw.shape[0],
+                  reduce_polygon(saw).shape[0]))
+
+
+def reduce_polygon_classification_unit_test():
+    """Return None. Reduction must leave the classification of every test chain unchanged"""
+    num_passed, num_chains = 0, 0
+    for test_case in [TEST_CASE_KNOTS] + TRIVIAL_CASES:
+        with open(test_case) as ifile:
+            print("Loading test data from file {}...".format(test_case))
+            test_chains = json.load(ifile)["tests"]
+        for i, chain in enumerate(test_chains):
+            saw = np.array(chain, dtype=np.float64)
+            alex_poly, reduced_alex_poly = (alexander_polynomial(underpass_info_of_chain(chain))
+                                            for chain in (saw, reduce_polygon(saw)))
+            passed = reduced_alex_poly == alex_poly and \
+                     classify_chain(saw, reduce=True)[0] == classify_chain(saw)[0]
+            num_passed += passed
+            if not passed:
+                print("{} chain {}: {} -> {} when reduced (FAILED)".format(test_case, i, alex_poly,
+                      reduced_alex_poly))
+        num_chains += len(test_chains)
+    print("Passed {} of {} chains.".format(num_passed, num_chains))